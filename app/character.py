@@ -1,9 +1,114 @@
 """
 Character management module for the text adventure game.
 """
-import os
+import re
+import sys
+import hashlib
 from pathlib import Path
 import random
+
+from llm import FALLBACK_RESPONSES
+
+# Stands in for the player's name in cached descriptions
+NAME_PLACEHOLDER = "<<NAME>>"
+
+# Section headers the description template asks the LLM to finish with
+SECTION_RE = re.compile(r'^\W*(Starting Items|Companion)\W*$', re.MULTILINE | re.IGNORECASE)
+BULLET_RE = re.compile(r'^\s*[-*•]\s+(.+?)\s*$', re.MULTILINE)
+
+# Character creation options
+GENDERS = (
+    "Male",
+    "Female",
+    "Non-Binary",
+    "Agender",
+    "Bigender",
+    "Genderfluid",
+    "Genderqueer",
+    "Demiboy",
+    "Demigirl",
+    "Androgynous",
+    "Two-Spirit",
+    "Neutrois",
+    "Polygender",
+    "Third Gender",
+    "Xenogender",
+    "Questioning",
+)
+
+BACKGROUNDS = (
+    "Elementary School Teacher",
+    "Movie Star",
+    "Construction Worker",
+    "Cardiologist",
+    "Hedge Fund Specialist",
+    "Career Politician",
+    "Theoretical Physicist",
+    "Stay-at-home Mom",
+    "Mid-level Software Engineer",
+    "Beet Farmer",
+    "Manager of a struggling paper company",
+    "High School Librarian",
+    "Escape Room Designer",
+    "Used Car Salesperson",
+)
+
+TRAITS_POSITIVE = (
+    "Resourceful",
+    "Brave",
+    "Charismatic",
+    "Strategic",
+    "Cunning",
+    "Resilient",
+    "Empathetic",
+    "Optimistic",
+    "Tinkerer",
+    "Sharp-Eyed",
+)
+
+TRAITS_NEUTRAL = (
+    "Lone Wolf",
+    "Sarcastic",
+    "Risk-Taker",
+    "Suspicious",
+    "Pragmatic",
+    "Obsessive",
+    "Daydreamer",
+    "Stubborn",
+    "Rule-Breaker",
+)
+
+TRAITS_NEGATIVE = (
+    "Hot-Tempered",
+    "Reckless",
+    "Gullible",
+    "Forgetful",
+    "Anxious",
+    "Greedy",
+    "Self-Destructive",
+    "Cowardly",
+    "Arrogant",
+)
+
+# Title-cased copies for display; the raw values are what gets stored
+GENDERS_TITLED = tuple(gender.title() for gender in GENDERS)
+BACKGROUNDS_TITLED = tuple(background.title() for background in BACKGROUNDS)
+TRAITS_POSITIVE_TITLED = tuple(trait.title() for trait in TRAITS_POSITIVE)
+TRAITS_NEUTRAL_TITLED = tuple(trait.title() for trait in TRAITS_NEUTRAL)
+TRAITS_NEGATIVE_TITLED = tuple(trait.title() for trait in TRAITS_NEGATIVE)
+
+# Numbered menus for each option list, rendered once
+MENUS = {
+    options: "\n".join(f"{i}. {option}" for i, option in enumerate(titled, 1))
+    for options, titled in (
+        (GENDERS, GENDERS_TITLED),
+        (BACKGROUNDS, BACKGROUNDS_TITLED),
+        (TRAITS_POSITIVE, TRAITS_POSITIVE_TITLED),
+        (TRAITS_NEUTRAL, TRAITS_NEUTRAL_TITLED),
+        (TRAITS_NEGATIVE, TRAITS_NEGATIVE_TITLED),
+    )
+}
+
 class CharacterManager:
     """Manages character creation and information."""
     
@@ -11,80 +116,24 @@ class CharacterManager:
         """Initialize the character manager."""
         self.db = db
         self.llm_client = llm_client
-
-        self.genders = [
-            "Male",
-            "Female",
-            "Non-Binary",
-            "Agender",
-            "Bigender",
-            "Genderfluid",
-            "Genderqueer",
-            "Demiboy",
-            "Demigirl",
-            "Androgynous",
-            "Two-Spirit",
-            "Neutrois",
-            "Polygender",
-            "Third Gender",
-            "Xenogender",
-            "Questioning",
-
-        ]
-
-        self.backgrounds = [
-            "Elementary School Teacher",
-            "Movie Star",
-            "Construction Worker",
-            "Cardiologist",
-            "Hedge Fund Specialist",
-            "Career Politician",
-            "Theoretical Physicist",
-            "Stay-at-home Mom",
-            "Mid-level Software Engineer",
-            "Beet Farmer",
-            "Manager of a struggling paper company",
-            "High School Librarian",
-            "Escape Room Designer",
-            "Used Car Salesperson"
-        ]
-
-        self.traits_positive = [
-            "Resourceful",
-            "Brave",
-            "Charismatic",
-            "Strategic",
-            "Cunning",
-            "Resilient",
-            "Empathetic",
-            "Optimistic",
-            "Tinkerer",
-            "Sharp-Eyed"
-        ]
-
-        self.traits_neutral = [
-            "Lone Wolf",
-            "Sarcastic",
-            "Risk-Taker",
-            "Suspicious",
-            "Pragmatic",
-            "Obsessive",
-            "Daydreamer",
-            "Stubborn",
-            "Rule-Breaker"
-        ]
-
-        self.traits_negative = [
-            "Hot-Tempered",
-            "Reckless",
-            "Gullible",
-            "Forgetful",
-            "Anxious",
-            "Greedy",
-            "Self-Destructive",
-            "Cowardly",
-            "Arrogant",
-        ]
+        
+        # Load the description template once rather than on every character
+        self._template_path = Path(__file__).resolve().parent.parent / "data" / "prompts" / "character_creation.txt"
+        self._template_text = self._template_path.read_text() if self._template_path.exists() else None
+        # Part of the description cache key, so editing the template retires old descriptions
+        self._template_digest = hashlib.sha1((self._template_text or "").encode()).hexdigest()
+        
+        # Option lists are shared module-level tuples
+        self.genders = GENDERS
+        self.backgrounds = BACKGROUNDS
+        self.traits_positive = TRAITS_POSITIVE
+        self.traits_neutral = TRAITS_NEUTRAL
+        self.traits_negative = TRAITS_NEGATIVE
+        
+        self._menus = MENUS
+        
+        # Dedicated generator for the "Random" menu option
+        self._rng = random.Random()
     
     def create_character(self):
         """Create a new character through user interaction."""
@@ -99,133 +148,136 @@ class CharacterManager:
                 print("You must enter a name.")
         
         # Select gender
-        print("\nSelect your character's gender:")
-        for i, gender in enumerate(self.genders, 1):
-            print(f"{i}. {gender.title()}")
-        print("0. Random")
-        
-        gender_choice = -1
-        while gender_choice < 0 or gender_choice > len(self.genders):
-            try:
-                gender_choice = int(input(f"\nEnter a number (0-{len(self.genders)}): "))
-            except ValueError:
-                print("Please enter a valid number.")
-        
-        if gender_choice == 0:
-            # Randomly select a gender
-            gender = random.choice(self.genders)
-        else:
-            gender = self.genders[gender_choice - 1]
+        gender = self._prompt_choice("\nSelect your character's gender:", self.genders)
 
         # Select background
-        print("\nSelect your character's background:")
-        for i, bg in enumerate(self.backgrounds, 1):
-            print(f"{i}. {bg.title()}")
-        print("0. Random")
-        
-        background_choice = -1
-        while background_choice < 0 or background_choice > len(self.backgrounds):
-            try:
-                background_choice = int(input(f"\nEnter a number (0-{len(self.backgrounds)}): "))
-            except ValueError:
-                print("Please enter a valid number.")
-        
-        if background_choice == 0:
-            # Randomly select a background
-            background = random.choice(self.backgrounds)
-        else:
-            background = self.backgrounds[background_choice - 1]
+        background = self._prompt_choice("\nSelect your character's background:", self.backgrounds)
         
         # Select traits
         print("\nSelect your character's primary personality traits.")
+        positive_trait = self._prompt_choice("Positive Traits:", self.traits_positive)
+        neutral_trait = self._prompt_choice("Neutral Traits:", self.traits_neutral)
+        negative_trait = self._prompt_choice("Negative Traits:", self.traits_negative)
+        
+        traits = f"{positive_trait}, {neutral_trait}, {negative_trait}"
+        traits_titled = traits.title()
+
+        print(f"\nYour character's traits are: {traits_titled}")
 
-        print("Positive Traits:")
-        for i, trait in enumerate(self.traits_positive, 1):
-            print(f"{i}. {trait.title()}")
-        print("0. Random")
+        # Display character info while the description is generated
+        print("\n=== YOUR CHARACTER ===\n")
+        print(f"Name: {name}")
+        print(f"Gender: {gender}")
+        print(f"Background: {background.title()}")
+        print(f"Traits: {traits_titled}")
+        print("\nDescription:")
         
-        positive_trait_choice = -1
-        while positive_trait_choice < 0 or positive_trait_choice > len(self.traits_positive):
-            try:
-                positive_trait_choice = int(input(f"\nEnter a number (0-{len(self.traits_positive)}): "))
-            except ValueError:
-                print("Please enter a valid number.")
+        # One LLM call returns the description plus starting items and a companion,
+        # written to the terminal as it streams in
+        chunks = []
+        for chunk in self._cached_description(name, gender, background, traits):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+            chunks.append(chunk)
+        print()
         
-        if positive_trait_choice == 0:
-            # Randomly select a positive trait
-            positive_trait = random.choice(self.traits_positive)
-        else:
-            positive_trait = self.traits_positive[positive_trait_choice - 1]
-
-        print("Neutral Traits:")
-        for i, trait in enumerate(self.traits_neutral, 1):
-            print(f"{i}. {trait.title()}")
-        print("0. Random")
+        description, items, companions = self._parse_character_response("".join(chunks))
         
-        neutral_trait_choice = -1
-        while neutral_trait_choice < 0 or neutral_trait_choice > len(self.traits_neutral):
-            try:
-                neutral_trait_choice = int(input(f"\nEnter a number (0-{len(self.traits_neutral)}): "))
-            except ValueError:
-                print("Please enter a valid number.")
+        # Create character in database
+        player = self.db.create_player(name, background, traits, description, items, companions)
         
-        if neutral_trait_choice == 0:
-            # Randomly select a neutral trait
-            neutral_trait = random.choice(self.traits_neutral)
-        else:
-            neutral_trait = self.traits_neutral[neutral_trait_choice - 1]
-
-        print("Negative Traits:")
-        for i, trait in enumerate(self.traits_negative, 1):
-            print(f"{i}. {trait.title()}")
-        print("0. Random")
+        print("\nPress Enter to begin your adventure...")
+        input()
+        
+        return player
+    
+    def _prompt_choice(self, label, options):
+        """Show a numbered menu of options and return the player's choice."""
+        # Pass the whole menu as the input() prompt so it is written in one go
+        maximum = len(options)
+        prompt = f"{label}\n{self._menus[options]}\n0. Random\n\nEnter a number (0-{maximum}): "
+        
+        choice = self._read_number(prompt, maximum)
+        if choice == 0:
+            return self._rng.choice(options)
+        return options[choice - 1]
+    
+    def _read_number(self, prompt, maximum):
+        """Read a number between 0 and maximum from the player."""
+        retry_prompt = f"\nEnter a number (0-{maximum}): "
         
-        negative_trait_choice = -1
-        while negative_trait_choice < 0 or negative_trait_choice > len(self.traits_negative):
+        while True:
             try:
-                negative_trait_choice = int(input(f"\nEnter a number (0-{len(self.traits_negative)}): "))
+                choice = int(input(prompt))
             except ValueError:
                 print("Please enter a valid number.")
+                prompt = retry_prompt
+                continue
+            
+            if 0 <= choice <= maximum:
+                return choice
+            prompt = retry_prompt
+    
+    def _cached_description(self, name, gender, background, traits):
+        """Yield a character description, reusing a cached one for the same choices."""
+        # The name is left out of the key so descriptions can be shared between players
+        key = hashlib.sha1(f"{self._template_digest}|{gender}|{background}|{traits}".encode()).hexdigest()
         
-        if negative_trait_choice == 0:
-            # Randomly select a negative trait
-            negative_trait = random.choice(self.traits_negative)
-        else:
-            negative_trait = self.traits_negative[negative_trait_choice - 1]
-        
-        traits = f"{positive_trait}, {neutral_trait}, {negative_trait}"
-
-        print(f"\nYour character's traits are: {traits.title()}")
-
-        # Generate character description
-        print("\nGenerating your character description...")
-        
-        # Get template path
-        template_path = Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "prompts" / "character_creation.txt"
+        cached = self.db.get_cached_description(key)
+        if cached is not None:
+            yield cached.replace(NAME_PLACEHOLDER, name)
+            return
         
-        description = self.llm_client.generate_character_description(
-            name, 
+        # The template has the LLM write the placeholder instead of the name,
+        # which is filled in as the text streams
+        chunks = []
+        pending = ""
+        for chunk in self.llm_client.stream_character_description(
+            NAME_PLACEHOLDER,
             gender,
-            background, 
+            background,
             traits,
-            template_path if template_path.exists() else None
-        )
+            self._template_text
+        ):
+            chunks.append(chunk)
+            pending += chunk
+            ready, pending = self._split_partial_placeholder(pending)
+            if ready:
+                yield ready.replace(NAME_PLACEHOLDER, name)
+        if pending:
+            yield pending.replace(NAME_PLACEHOLDER, name)
+        description = "".join(chunks)
         
-        # Create character in database
-        player = self.db.create_player(name, background, traits, description)
+        # Don't cache API failures, or text that names the character some
+        # other way and so can't be shared
+        if NAME_PLACEHOLDER in description and description not in FALLBACK_RESPONSES:
+            self.db.cache_description(key, description)
+    
+    @staticmethod
+    def _split_partial_placeholder(text):
+        """Split text into a part that can be shown and a trailing partial placeholder."""
+        for size in range(min(len(NAME_PLACEHOLDER) - 1, len(text)), 0, -1):
+            if NAME_PLACEHOLDER.startswith(text[-size:]):
+                return text[:-size], text[-size:]
+        return text, ""
+    
+    def _parse_character_response(self, response):
+        """Split the LLM response into description, starting items and companions."""
+        sections = SECTION_RE.split(response)
+        description = sections[0].strip()
+        items = []
+        companions = []
         
-        # Display character info
-        print("\n=== YOUR CHARACTER ===\n")
-        print(f"Name: {name}")
-        print(f"Gender: {gender}")
-        print(f"Background: {background.title()}")
-        print(f"Traits: {traits.title()}")
-        print("\nDescription:")
-        print(description)
-        print("\nPress Enter to begin your adventure...")
-        input()
+        # split() alternates section names and their bodies after the description
+        for title, body in zip(sections[1::2], sections[2::2]):
+            for entry in BULLET_RE.findall(body):
+                if title.lower() == "starting items":
+                    items.append(entry)
+                elif ':' in entry:
+                    companion_name, companion_description = entry.split(':', 1)
+                    companions.append((companion_name.strip("* "), companion_description.strip()))
         
-        return player
+        return description, items, companions
     
     def get_character_summary(self, player):
         """Get a summary of the character."""
@@ -9,7 +9,7 @@ class Config:
     
     def __init__(self):
         # Base paths
-        self.base_dir = Path(os.path.dirname(os.path.abspath(__file__))).parent
+        self.base_dir = Path(__file__).resolve().parent.parent
         self.data_dir = self.base_dir / "data"
         self.prompts_dir = self.data_dir / "prompts"
         
@@ -22,12 +22,17 @@ class Config:
         
         # LLM settings
         self.model = "gpt-4o-mini"  # Default model
+        self.segment_model = "gpt-4o-mini"  # Model for per-turn story segments, e.g. "gpt-4.1-nano" for speed
         self.temperature = 0.7
         self.max_tokens = 500
         
         # Game settings
         self.max_rounds = 20  # Default max rounds for a game
         self.max_history_items = 10  # Max number of history items to keep in memory
+        # Generate the next segment for each choice in the background. Turns
+        # answered from a prefetch appear instantly, but every turn then makes
+        # three segment requests instead of one on your API key
+        self.prefetch_choices = False
         
         # Prompt templates
         self.system_prompt_path = self.prompts_dir / "system_prompt.txt"
@@ -39,8 +44,20 @@ class Config:
     
     def _create_default_prompts(self):
         """Create default prompt templates if they don't exist."""
+        # Skip the check entirely if no files were added to or removed from the
+        # prompts directory since the last run
+        marker_path = self.prompts_dir / ".initialized"
+        try:
+            if marker_path.read_text() == str(self.prompts_dir.stat().st_mtime_ns):
+                return
+        except FileNotFoundError:
+            pass
+        
+        # List the directory once instead of checking each file
+        existing = {entry.name for entry in os.scandir(self.prompts_dir)}
+        
         # System prompt
-        if not self.system_prompt_path.exists():
+        if self.system_prompt_path.name not in existing:
             system_prompt = """You are the Game Master for a post-apocalyptic text adventure game set in a world ravaged by climate disaster. 
 Your role is to create an immersive, engaging narrative experience for the player.
 
@@ -58,11 +75,10 @@ Nature has been transformed - some areas are barren, others overtaken by mutated
 
 Always end your responses with 2-3 clear options for the player, or prompt them for their next action."""
             
-            with open(self.system_prompt_path, 'w') as f:
-                f.write(system_prompt)
+            self.system_prompt_path.write_text(system_prompt)
         
         # Character creation prompt
-        if not self.character_prompt_path.exists():
+        if self.character_prompt_path.name not in existing:
             character_prompt = """Based on the following information about a player character in a post-apocalyptic world after a climate disaster, create a brief character description (2-3 paragraphs).
 
 Name: {name}
@@ -77,11 +93,10 @@ The description should include:
 
 Keep the tone consistent with a climate disaster setting, but allow for personal hope and motivation."""
             
-            with open(self.character_prompt_path, 'w') as f:
-                f.write(character_prompt)
+            self.character_prompt_path.write_text(character_prompt)
         
         # Story generation prompt
-        if not self.story_prompt_path.exists():
+        if self.story_prompt_path.name not in existing:
             story_prompt = """Continue the post-apocalyptic adventure with the following context:
 
 Character: {character_description}
@@ -105,5 +120,8 @@ Make sure your response:
 4. Maintains consistency with the established world and previous events
 5. Reflects the tone of a climate-disaster post-apocalyptic setting"""
             
-            with open(self.story_prompt_path, 'w') as f:
-                f.write(story_prompt) 
\ No newline at end of file
+            self.story_prompt_path.write_text(story_prompt)
+        
+        # Creating the marker changes the directory mtime, so record it afterwards
+        marker_path.touch()
+        marker_path.write_text(str(self.prompts_dir.stat().st_mtime_ns))
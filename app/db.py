@@ -6,194 +6,221 @@ import sqlite3
 import json
 from pathlib import Path
 
+# Use orjson for the inventory when it's installed
+try:
+    import orjson
+    
+    def _dumps(value):
+        return orjson.dumps(value).decode()
+    
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
+# Bump when the schema changes so existing databases get migrated
+SCHEMA_VERSION = 2
+
+# Tables and indexes, run as one script by the migration
+SCHEMA_SQL = """
+-- Player table
+CREATE TABLE IF NOT EXISTS player (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    background TEXT NOT NULL,
+    traits TEXT NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Game state table
+CREATE TABLE IF NOT EXISTS game_state (
+    id INTEGER PRIMARY KEY,
+    player_id INTEGER,
+    current_round INTEGER DEFAULT 1,
+    current_situation TEXT,
+    story_premise TEXT,
+    current_summary TEXT,
+    FOREIGN KEY (player_id) REFERENCES player(id)
+);
+
+-- Events table
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER,
+    round INTEGER,
+    description TEXT,
+    player_action TEXT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (game_id) REFERENCES game_state(id)
+);
+
+-- NPCs table
+CREATE TABLE IF NOT EXISTS npcs (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER,
+    name TEXT,
+    description TEXT,
+    relationship TEXT DEFAULT 'neutral',
+    first_met_round INTEGER,
+    FOREIGN KEY (game_id) REFERENCES game_state(id)
+);
+
+-- Inventory table (simple)
+CREATE TABLE IF NOT EXISTS inventory (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER,
+    items TEXT,  -- JSON string of items
+    FOREIGN KEY (game_id) REFERENCES game_state(id)
+);
+
+-- Character description cache
+CREATE TABLE IF NOT EXISTS description_cache (
+    key TEXT PRIMARY KEY,
+    description TEXT
+);
+
+-- Indexes for the lookups made on every round
+CREATE INDEX IF NOT EXISTS idx_events_game_round ON events (game_id, round);
+CREATE INDEX IF NOT EXISTS idx_npcs_game ON npcs (game_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_game ON inventory (game_id);
+CREATE INDEX IF NOT EXISTS idx_gs_player ON game_state (player_id);
+"""
+
+# Serialized form of a new, empty inventory
+EMPTY_INVENTORY = json.dumps([])
+
+# Statements run every turn. Keeping them as constants means each call passes
+# the identical string, so sqlite3's statement cache reuses the prepared plan
+SELECT_GAME_STATE_SQL = "SELECT * FROM game_state WHERE id = ?"
+UPDATE_GAME_STATE_SQL = """UPDATE game_state SET
+    current_round = COALESCE(?, current_round),
+    current_situation = COALESCE(?, current_situation),
+    story_premise = COALESCE(?, story_premise),
+    current_summary = COALESCE(?, current_summary)
+WHERE id = ?"""
+INSERT_EVENT_SQL = "INSERT INTO events (game_id, round, description, player_action) VALUES (?, ?, ?, ?)"
+UPDATE_EVENT_ACTION_SQL = "UPDATE events SET player_action = ? WHERE game_id = ? AND round = ?"
+SELECT_RECENT_EVENTS_SQL = "SELECT * FROM events WHERE game_id = ? ORDER BY round DESC LIMIT ?"
+INSERT_NPC_SQL = "INSERT INTO npcs (game_id, name, description, relationship, first_met_round) VALUES (?, ?, ?, ?, ?)"
+UPDATE_NPC_SQL = "UPDATE npcs SET description = COALESCE(?, description), relationship = COALESCE(?, relationship) WHERE id = ?"
+SELECT_NPCS_SQL = "SELECT * FROM npcs WHERE game_id = ?"
+UPDATE_INVENTORY_SQL = "UPDATE inventory SET items = ? WHERE game_id = ?"
+SELECT_INVENTORY_SQL = "SELECT items FROM inventory WHERE game_id = ?"
+
 class Database:
     """Database manager for the game."""
     
     def __init__(self, db_path):
         """Initialize the database."""
         self.db_path = db_path
-        self._create_tables()
-        self._add_story_premise_column()
-    
-    def _create_tables(self):
-        """Create database tables if they don't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Player table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS player (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            background TEXT NOT NULL,
-            traits TEXT NOT NULL,
-            description TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Game state table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS game_state (
-            id INTEGER PRIMARY KEY,
-            player_id INTEGER,
-            current_round INTEGER DEFAULT 1,
-            current_situation TEXT,
-            story_premise TEXT,
-            current_summary TEXT,
-            FOREIGN KEY (player_id) REFERENCES player(id)
-        )
-        ''')
-        
-        # Events table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY,
-            game_id INTEGER,
-            round INTEGER,
-            description TEXT,
-            player_action TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (game_id) REFERENCES game_state(id)
-        )
-        ''')
         
-        # NPCs table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS npcs (
-            id INTEGER PRIMARY KEY,
-            game_id INTEGER,
-            name TEXT,
-            description TEXT,
-            relationship TEXT DEFAULT 'neutral',
-            first_met_round INTEGER,
-            FOREIGN KEY (game_id) REFERENCES game_state(id)
-        )
-        ''')
-        
-        # Inventory table (simple)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inventory (
-            id INTEGER PRIMARY KEY,
-            game_id INTEGER,
-            items TEXT,  -- JSON string of items
-            FOREIGN KEY (game_id) REFERENCES game_state(id)
-        )
-        ''')
+        # Keep one connection open for the lifetime of the game
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-20000")
         
-        conn.commit()
-        conn.close()
+        self._migrate()
     
-    def _add_story_premise_column(self):
-        """Add story_premise column to game_state table if it doesn't exist."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if story_premise column exists in game_state table
+    def _migrate(self):
+        """Create or upgrade the schema if the database file is out of date."""
+        cursor = self._conn.cursor()
+        
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
+        
+        # Run every schema change in a single transaction. executescript commits
+        # anything pending before it runs, so the script opens the transaction
+        with self._conn:
+            cursor.executescript("BEGIN;" + SCHEMA_SQL)
+            self._add_missing_columns(cursor)
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    
+    def _add_missing_columns(self, cursor):
+        """Add columns introduced after the game_state table was first created."""
         cursor.execute("PRAGMA table_info(game_state)")
-        columns = [column[1] for column in cursor.fetchall()]
+        columns = {column[1] for column in cursor.fetchall()}
         
         # Add story_premise column if it doesn't exist
         if 'story_premise' not in columns:
             print("Adding story_premise column to game_state table")
             cursor.execute("ALTER TABLE game_state ADD COLUMN story_premise TEXT")
-            conn.commit()
             
         # Add current_summary column if it doesn't exist
         if 'current_summary' not in columns:
             print("Adding current_summary column to game_state table")
             cursor.execute("ALTER TABLE game_state ADD COLUMN current_summary TEXT")
-            conn.commit()
-        
-        conn.close()
     
-    def create_player(self, name, background, traits, description=None):
-        """Create a new player character."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO player (name, background, traits, description) VALUES (?, ?, ?, ?)",
-            (name, background, traits, description)
-        )
-        player_id = cursor.lastrowid
-        
-        # Create initial game state
-        cursor.execute(
-            "INSERT INTO game_state (player_id) VALUES (?)",
-            (player_id,)
-        )
-        game_id = cursor.lastrowid
-        
-        # Create empty inventory
-        cursor.execute(
-            "INSERT INTO inventory (game_id, items) VALUES (?, ?)",
-            (game_id, json.dumps([]))
-        )
-        
-        conn.commit()
-        conn.close()
+    def create_player(self, name, background, traits, description=None, items=None, npcs=None):
+        """Create a new player character with optional starting items and NPCs."""
+        # Insert the player, game state and inventory in one transaction so a
+        # failure part way through doesn't leave a half-created game behind
+        with self._conn:
+            cursor = self._conn.cursor()
+            
+            cursor.execute(
+                "INSERT INTO player (name, background, traits, description) VALUES (?, ?, ?, ?)",
+                (name, background, traits, description)
+            )
+            player_id = cursor.lastrowid
+            
+            # Create initial game state
+            cursor.execute(
+                "INSERT INTO game_state (player_id) VALUES (?)",
+                (player_id,)
+            )
+            game_id = cursor.lastrowid
+            
+            # Create starting inventory
+            cursor.execute(
+                "INSERT INTO inventory (game_id, items) VALUES (?, ?)",
+                (game_id, _dumps(items) if items else EMPTY_INVENTORY)
+            )
+            
+            # Add any NPCs the character starts out knowing
+            if npcs:
+                cursor.executemany(
+                    "INSERT INTO npcs (game_id, name, description, first_met_round) VALUES (?, ?, ?, 1)",
+                    [(game_id, npc_name, npc_description) for npc_name, npc_description in npcs]
+                )
         
         return self.get_player(player_id)
     
     def get_player(self, player_id):
         """Get player data by ID."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
         
-        cursor.execute("SELECT * FROM player WHERE id = ?", (player_id,))
+        # Fetch the player and their game ID together
+        cursor.execute(
+            "SELECT p.*, g.id AS game_id FROM player p LEFT JOIN game_state g ON g.player_id = p.id WHERE p.id = ?",
+            (player_id,)
+        )
         player = dict(cursor.fetchone())
         
-        cursor.execute("SELECT id FROM game_state WHERE player_id = ?", (player_id,))
-        game_state = cursor.fetchone()
-        if game_state:
-            player['game_id'] = game_state['id']
-        
-        conn.close()
         return player
     
     def update_game_state(self, game_id, current_round=None, current_situation=None, story_premise=None, current_summary=None):
-        """Update the game state."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if current_round is not None:
-            updates.append("current_round = ?")
-            params.append(current_round)
-        
-        if current_situation is not None:
-            updates.append("current_situation = ?")
-            params.append(current_situation)
-            
-        if story_premise is not None:
-            updates.append("story_premise = ?")
-            params.append(story_premise)
-            
-        if current_summary is not None:
-            updates.append("current_summary = ?")
-            params.append(current_summary)
-        
-        if updates:
-            query = f"UPDATE game_state SET {', '.join(updates)} WHERE id = ?"
-            params.append(game_id)
-            cursor.execute(query, params)
-            conn.commit()
-        
-        conn.close()
+        """Update the game state, leaving fields passed as None unchanged."""
+        with self._conn:
+            self._conn.execute(
+                UPDATE_GAME_STATE_SQL,
+                (current_round, current_situation, story_premise, current_summary, game_id)
+            )
     
     def get_game_state(self, game_id):
         """Get the current game state."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
         
-        cursor.execute("SELECT * FROM game_state WHERE id = ?", (game_id,))
-        row = cursor.fetchone()
+        cursor.execute(SELECT_GAME_STATE_SQL, (game_id,))
         
+        return self._game_state_from_row(game_id, cursor.fetchone())
+    
+    def _game_state_from_row(self, game_id, row):
+        """Convert a game_state row to a dict, with defaults if it is missing."""
         if row:
             state = dict(row)
         else:
@@ -205,133 +232,167 @@ class Database:
                 "current_summary": ""
             }
         
-        conn.close()
         return state
     
+    def fetch_turn_bundle(self, game_id, event_limit=10, with_state=True):
+        """Get the game state, recent events and NPCs in one read transaction.
+        
+        Returns a (game_state, recent_events, npcs) tuple; events are newest
+        first and game_state is None when with_state is False.
+        """
+        with self._conn:
+            cursor = self._conn.cursor()
+            # Read all three from the same snapshot, taking the lock once
+            if not self._conn.in_transaction:
+                cursor.execute("BEGIN")
+            
+            state = None
+            if with_state:
+                cursor.execute(SELECT_GAME_STATE_SQL, (game_id,))
+                state = self._game_state_from_row(game_id, cursor.fetchone())
+            
+            cursor.execute(SELECT_RECENT_EVENTS_SQL, (game_id, event_limit))
+            events = [dict(row) for row in cursor]
+            
+            cursor.execute(SELECT_NPCS_SQL, (game_id,))
+            npcs = [dict(row) for row in cursor]
+        
+        return state, events, npcs
+    
     def add_event(self, game_id, round_num, description, player_action):
         """Add a new event to the game history."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
 
         #print()
         # print("+ Adding event: " + str(round_num))
         # print("+ Description:" + description)
         # print("+ Player action: " + player_action)
-
         
         cursor.execute(
-            "INSERT INTO events (game_id, round, description, player_action) VALUES (?, ?, ?, ?)",
+            INSERT_EVENT_SQL,
             (game_id, round_num, description, player_action)
         )
         
-        conn.commit()
-        conn.close()
+        self._conn.commit()
     
     def update_event_action(self, game_id, round_num, player_action):
         """Update an existing event with the player's action."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
         
 #        print()
         # print("+ Updating event action for round: " + str(round_num))
         # print("+ Player action: " + player_action)
         
         cursor.execute(
-            "UPDATE events SET player_action = ? WHERE game_id = ? AND round = ?",
+            UPDATE_EVENT_ACTION_SQL,
             (player_action, game_id, round_num)
         )
         
-        conn.commit()
-        conn.close()
+        self._conn.commit()
     
     def get_recent_events(self, game_id, limit=10):
         """Get recent events from the game history."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT * FROM events WHERE game_id = ? ORDER BY round DESC LIMIT ?",
+        return list(self.iter_recent_events(game_id, limit))
+    
+    def iter_recent_events(self, game_id, limit=10):
+        """Yield recent events from the game history, newest first."""
+        cursor = self._conn.execute(
+            SELECT_RECENT_EVENTS_SQL,
             (game_id, limit)
         )
-        events = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        return events
+        return (dict(row) for row in cursor)
     
     def add_npc(self, game_id, name, description, relationship="neutral", first_met_round=1):
         """Add a new NPC to the game."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
         
         cursor.execute(
-            "INSERT INTO npcs (game_id, name, description, relationship, first_met_round) VALUES (?, ?, ?, ?, ?)",
+            INSERT_NPC_SQL,
             (game_id, name, description, relationship, first_met_round)
         )
         
-        conn.commit()
-        conn.close()
+        self._conn.commit()
+    
+    def add_npcs(self, game_id, npcs):
+        """Add several NPCs in one transaction.
+        
+        Each NPC is a (name, description, relationship, first_met_round) tuple.
+        """
+        with self._conn:
+            self._conn.executemany(
+                INSERT_NPC_SQL,
+                [(game_id, *npc) for npc in npcs]
+            )
     
     def update_npc(self, npc_id, description=None, relationship=None):
         """Update an NPC's information."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if description is not None:
-            updates.append("description = ?")
-            params.append(description)
-        
-        if relationship is not None:
-            updates.append("relationship = ?")
-            params.append(relationship)
-        
-        if updates:
-            query = f"UPDATE npcs SET {', '.join(updates)} WHERE id = ?"
-            params.append(npc_id)
-            cursor.execute(query, params)
-            conn.commit()
-        
-        conn.close()
+        self.update_npcs([(description, relationship, npc_id)])
+    
+    def update_npcs(self, updates):
+        """Update several NPCs in one transaction.
+        
+        Each update is a (description, relationship, npc_id) tuple; pass None
+        for a field to leave it unchanged.
+        """
+        with self._conn:
+            self._conn.executemany(
+                UPDATE_NPC_SQL,
+                updates
+            )
     
     def get_npcs(self, game_id):
         """Get all NPCs for a game."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM npcs WHERE game_id = ?", (game_id,))
-        npcs = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        return npcs
+        return list(self.iter_npcs(game_id))
+    
+    def iter_npcs(self, game_id):
+        """Yield the NPCs for a game one at a time."""
+        cursor = self._conn.execute(SELECT_NPCS_SQL, (game_id,))
+        return (dict(row) for row in cursor)
     
     def update_inventory(self, game_id, items):
         """Update the player's inventory."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
         
         cursor.execute(
-            "UPDATE inventory SET items = ? WHERE game_id = ?",
-            (json.dumps(items), game_id)
+            UPDATE_INVENTORY_SQL,
+            (_dumps(items), game_id)
         )
         
-        conn.commit()
-        conn.close()
+        self._conn.commit()
     
     def get_inventory(self, game_id):
         """Get the player's inventory."""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
         
-        cursor.execute("SELECT items FROM inventory WHERE game_id = ?", (game_id,))
+        cursor.execute(SELECT_INVENTORY_SQL, (game_id,))
         result = cursor.fetchone()
         
-        conn.close()
+        if result:
+            return _loads(result['items'])
+        return []
+    
+    def get_cached_description(self, key):
+        """Get a cached character description by key."""
+        cursor = self._conn.cursor()
+        
+        cursor.execute("SELECT description FROM description_cache WHERE key = ?", (key,))
+        result = cursor.fetchone()
         
         if result:
-            return json.loads(result['items'])
-        return [] 
\ No newline at end of file
+            return result[0]
+        return None
+    
+    def cache_description(self, key, description):
+        """Store a character description in the cache."""
+        cursor = self._conn.cursor()
+        
+        cursor.execute(
+            "INSERT OR REPLACE INTO description_cache (key, description) VALUES (?, ?)",
+            (key, description)
+        )
+        
+        self._conn.commit()
+    
+    def close(self):
+        """Close the database connection."""
+        self._conn.close()
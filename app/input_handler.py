@@ -5,6 +5,18 @@ Processes player input and commands.
 from text_formatter import bold, colored, underline, CYAN, GREEN, YELLOW, RED
 import re
 
+# Inputs accepted when the player is expected to pick a choice
+VALID_CHOICES = frozenset({"1", "2", "3"})
+
+# Styled strings that never change, built once at import
+NO_ACTIVE_GAME = colored("No active game.", RED)
+INVENTORY_HEADER = f"\n{bold(colored('=== INVENTORY ===', CYAN))}\n\n"
+JOURNAL_HEADER = f"\n{bold(colored('=== RECENT EVENTS ===', CYAN))}\n\n"
+CHARACTERS_HEADER = f"\n{bold(colored('=== CHARACTERS ===', CYAN))}\n\n"
+YOUR_ACTION_LABEL = underline('Your action:')
+QUIT_PROMPT = f"\n{colored('Are you sure you want to end your adventure? (y/n)', YELLOW)}"
+CONTINUE_MESSAGE = f"\n{colored('Adventure continues...', GREEN)}\n"
+
 class InputHandler:
     """Handles player input and commands."""
     
@@ -34,7 +46,7 @@ class InputHandler:
     def process_input(self, user_input, player):
         """Process player input."""
         # Check if input is a command
-        command = user_input.lower()
+        command = user_input.casefold()
         
         if command in self.commands:
             return self.commands[command](player)
@@ -54,19 +66,21 @@ class InputHandler:
     def _is_valid_choice(self, user_input):
         """Check if the user input is a valid choice (1, 2, or 3)."""
         # Strip whitespace and check if the input is exactly "1", "2", or "3"
-        stripped_input = user_input.strip()
-        return stripped_input in ["1", "2", "3"]
+        return user_input.strip() in VALID_CHOICES
     
     def _show_inventory(self, player):
         """Show the player's inventory."""
         game_id = player.get('game_id')
         if not game_id:
-            return {"type": "error", "result": colored("No active game.", RED)}
+            return {"type": "error", "result": NO_ACTIVE_GAME}
+        
+        # Include anything found in the segment the player is reading
+        self.story_engine.collect_summary()
         
         inventory = self.memory_manager.get_inventory(game_id)
         
         # Format inventory with colors and styling
-        inventory_text = f"\n{bold(colored('=== INVENTORY ===', CYAN))}\n\n"
+        inventory_text = INVENTORY_HEADER
         
         if not inventory:
             inventory_text += "Your inventory is empty.\n"
@@ -82,12 +96,12 @@ class InputHandler:
         """Show the player's recent events."""
         game_id = player.get('game_id')
         if not game_id:
-            return {"type": "error", "result": colored("No active game.", RED)}
+            return {"type": "error", "result": NO_ACTIVE_GAME}
         
         events = self.memory_manager.get_recent_events(game_id, 10)
         
         # Format journal with colors and styling
-        journal_text = f"\n{bold(colored('=== RECENT EVENTS ===', CYAN))}\n\n"
+        journal_text = JOURNAL_HEADER
         
         if not events:
             journal_text += "No events recorded yet.\n"
@@ -99,7 +113,7 @@ class InputHandler:
                 
                 journal_text += f"{bold(colored(f'Round {round_num}:', YELLOW))}\n"
                 journal_text += f"{text}\n"
-                journal_text += f"{underline('Your action:')} {action}\n\n"
+                journal_text += f"{YOUR_ACTION_LABEL} {action}\n\n"
         
         print(journal_text)
         
@@ -109,12 +123,15 @@ class InputHandler:
         """Show the characters the player has met."""
         game_id = player.get('game_id')
         if not game_id:
-            return {"type": "error", "result": colored("No active game.", RED)}
+            return {"type": "error", "result": NO_ACTIVE_GAME}
+        
+        # Include anything found in the segment the player is reading
+        self.story_engine.collect_summary()
         
         npcs = self.memory_manager.get_npcs(game_id)
         
         # Format characters with colors and styling
-        characters_text = f"\n{bold(colored('=== CHARACTERS ===', CYAN))}\n\n"
+        characters_text = CHARACTERS_HEADER
         
         if not npcs:
             characters_text += "You haven't met any notable characters yet.\n"
@@ -139,11 +156,11 @@ class InputHandler:
     
     def _quit_game(self, player):
         """Quit the game."""
-        print(f"\n{colored('Are you sure you want to end your adventure? (y/n)', YELLOW)}")
+        print(QUIT_PROMPT)
         confirm = input("> ").lower().startswith('y')
         
         if confirm:
             return {"type": "quit", "end_game": True}
         else:
-            print(f"\n{colored('Adventure continues...', GREEN)}\n")
+            print(CONTINUE_MESSAGE)
             return {"type": "continue"} 
\ No newline at end of file
@@ -1,24 +1,142 @@
 """
 LLM client module for OpenAI integration.
 """
+import json
+import logging
 import os
-import time
-from openai import OpenAI
+import re
+from functools import lru_cache
+from openai import APIError, AuthenticationError, BadRequestError, OpenAI
 from pathlib import Path
 
+# Use tiktoken for exact prompt token counts when it's installed
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Retries and timeout (seconds) applied by the OpenAI client to every request
+MAX_RETRIES = 3
+REQUEST_TIMEOUT = 30.0
+
+# A story segment is one scene plus three choices, well under this
+SEGMENT_MAX_TOKENS = 800
+
+# Token budget for the recent events included in each prompt; older rounds
+# are carried by the running story summary
+RECENT_EVENTS_TOKEN_BUDGET = 1500
+
+# Returned when the API cannot be reached after all retries
+FALLBACK_RESPONSE = "I'm having trouble connecting to my storytelling abilities right now. Please try again."
+
+# Returned when the model answers with no content, e.g. after a content filter
+EMPTY_RESPONSE = "The story falters for a moment. Please try a different action."
+
+# Responses that stand in for generated text and should never be stored
+FALLBACK_RESPONSES = frozenset({FALLBACK_RESPONSE, EMPTY_RESPONSE})
+
+WRITER_SYSTEM_PROMPT = "You are a writer who is an expert and creating engaging stories"
+
+# Per-entry formats used when building the story prompts
+SUMMARY_EVENT_FORMAT = "\n**********\n **Round {round}:**\n {desc} (Player Choice: {action})\n".format
+SEGMENT_EVENT_FORMAT = "\n**********\n **Round {round}:**\n {desc} \n Player Choice: {action}\n".format
+NPC_FORMAT = "- {name}: {relationship} - {desc}\n".format
+
+# Resolved once at import rather than on every call
+PROMPT_DIR = Path(__file__).resolve().parent.parent / "data" / "prompts"
+SYSTEM_PROMPT_PATH = PROMPT_DIR / "system_prompt.txt"
+
+# Section headers in the combined premise and opening response
+PREMISE_HEADER_RE = re.compile(r'^\W*Premise\W*$', re.MULTILINE | re.IGNORECASE)
+OPENING_HEADER_RE = re.compile(r'^\W*Opening\W*$', re.MULTILINE | re.IGNORECASE)
+
+def split_story_start(response):
+    """Split a combined story start response into (premise, opening).
+    
+    If the opening header is missing the whole response is used for both.
+    """
+    parts = OPENING_HEADER_RE.split(response, 1)
+    if len(parts) < 2:
+        return response, response
+    
+    premise = PREMISE_HEADER_RE.sub('', parts[0], count=1).strip()
+    return premise or response, parts[1].strip()
+
+def parse_summary(response):
+    """Split a JSON summary response into (summary, npcs, items).
+    
+    npcs is a list of (name, description) tuples and items a list of names.
+    Both are None when the response isn't the expected JSON, in which case
+    the whole response is used as the summary.
+    """
+    try:
+        data = json.loads(response)
+    except (TypeError, ValueError):
+        return response, None, None
+    
+    if not isinstance(data, dict) or not isinstance(data.get('summary'), str):
+        return response, None, None
+    
+    # Only lists of the expected shape are used; anything else counts as empty
+    raw_npcs = data.get('npcs')
+    raw_items = data.get('items')
+    npcs = [
+        (npc['name'].strip(), npc['description'] if isinstance(npc.get('description'), str) else '')
+        for npc in (raw_npcs if isinstance(raw_npcs, list) else [])
+        if isinstance(npc, dict) and isinstance(npc.get('name'), str) and npc['name'].strip()
+    ]
+    items = [
+        item.strip()
+        for item in (raw_items if isinstance(raw_items, list) else [])
+        if isinstance(item, str) and item.strip()
+    ]
+    return data['summary'], npcs, items
+
+@lru_cache(maxsize=32)
+def _load_template(path):
+    """Read a prompt template once, returning an empty string if it is missing."""
+    path = Path(path)
+    if not path.exists():
+        return ""
+    with open(path, 'r') as f:
+        return f.read()
+
 class LLMClient:
     """Client for interacting with OpenAI's LLM."""
     
-    def __init__(self, api_key=None, model="gpt-4o-mini"):
+    def __init__(self, api_key=None, model="gpt-4o-mini", segment_model=None):
         """Initialize the LLM client."""
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key is required")
         
         self.model = model
-        self.client = OpenAI(api_key=self.api_key)
+        # Per-turn story segments can use a faster model than the premise and summary
+        self.segment_model = segment_model or model
+        # The SDK retries rate limits and server errors with jittered backoff
+        # and keeps connections alive between calls
+        self.client = OpenAI(api_key=self.api_key, max_retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT)
+        
+        # Building an encoder is expensive, so do it once
+        self._enc = None
+        if tiktoken:
+            try:
+                self._enc = tiktoken.encoding_for_model(model)
+            except Exception as e:
+                logger.debug("No tiktoken encoding for %s, estimating tokens: %s", model, e)
+        
+        # The story system prompt does not change during a game
+        self._system_prompt = _load_template(str(SYSTEM_PROMPT_PATH))
+        
+        # Last (list, length, result) formatted for a prompt, so the summary
+        # and segment prompts of the same turn share the work
+        self._events_memo = None
+        self._npcs_memo = None
     
-    def generate_text(self, prompt, system_prompt=None, temperature=0.7, max_tokens=500):
+    def generate_text(self, prompt, system_prompt=None, temperature=0.7, max_tokens=500, model=None,
+                      response_format=None):
         """Generate text using the LLM."""
         messages = []
         
@@ -27,95 +145,214 @@ class LLMClient:
         
         messages.append({"role": "user", "content": prompt})
         
-        # Retry mechanism for API calls
-        max_retries = 3
-        retry_delay = 2
-
-        # Debugging
-        # print('=' * 40)
-        # print(messages)
-        # print('=' * 40)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request messages: %r", messages)
         
-        for attempt in range(max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                
-                # Debugging
-                # print('\n\n')
-                # print('*' * 40)
-                # print(response.choices[0].message.content)
-                # print('*' * 40)
-                # print('\n\n')
-                
-                return response.choices[0].message.content
+        request = {
+            "model": model or self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if response_format:
+            request["response_format"] = response_format
+        
+        try:
+            response = self.client.chat.completions.create(**request)
+        except (AuthenticationError, BadRequestError) as e:
+            # Not retried by the client; asking again would fail the same way
+            print(f"OpenAI rejected the request: {e}")
+            return FALLBACK_RESPONSE
+        except APIError as e:
+            print(f"Failed to generate text after {MAX_RETRIES} retries: {e}")
+            return FALLBACK_RESPONSE
+        
+        content = response.choices[0].message.content
+        logger.debug("Response: %s", content)
+        
+        if not content:
+            return EMPTY_RESPONSE
+        return content
+    
+    def stream_text(self, prompt, system_prompt=None, temperature=0.7, max_tokens=500, model=None):
+        """Generate text using the LLM, yielding chunks as they arrive."""
+        messages = []
+        
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        
+        messages.append({"role": "user", "content": prompt})
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request messages: %r", messages)
+        
+        received = False
+        try:
+            stream = self.client.chat.completions.create(
+                model=model or self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
             
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"Error calling OpenAI API: {e}. Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    print(f"Failed to generate text after {max_retries} attempts: {e}")
-                    return "I'm having trouble connecting to my storytelling abilities right now. Please try again."
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    received = True
+                    yield chunk.choices[0].delta.content
+        except (AuthenticationError, BadRequestError) as e:
+            # Not retried by the client; asking again would fail the same way
+            print(f"OpenAI rejected the request: {e}")
+            yield FALLBACK_RESPONSE
+            return
+        except APIError as e:
+            print(f"Failed to generate text after {MAX_RETRIES} retries: {e}")
+            # Keep whatever already reached the player if the stream broke midway
+            if not received:
+                yield FALLBACK_RESPONSE
+            return
+        
+        if not received:
+            yield EMPTY_RESPONSE
     
-    def generate_character_description(self, name, gender, background, traits, template_path=None):
-        """Generate a character description."""
-        template = ""
+    def _count_tokens(self, text):
+        """Count the tokens in text, estimating when tiktoken is unavailable."""
+        if self._enc:
+            return len(self._enc.encode(text))
+        return len(text) // 4 + 1
+    
+    def _trim_to_tokens(self, events, budget=RECENT_EVENTS_TOKEN_BUDGET):
+        """Return the newest events that fit in the token budget, oldest first."""
+        kept = []
+        used = 0
+        for event in sorted(events, key=lambda x: x.get('round', 0), reverse=True):
+            used += self._count_tokens(event.get('description') or '')
+            # Always keep the latest event, even if it alone exceeds the budget
+            if used > budget and kept:
+                break
+            kept.append(event)
+        
+        kept.reverse()
+        return kept
+    
+    def _format_events(self, recent_events, event_format, player_action=None):
+        """Format recent events for a prompt, oldest first.
         
-        if template_path and Path(template_path).exists():
-            with open(template_path, 'r') as f:
-                template = f.read()
+        Each event is labelled with player_action when given, otherwise with
+        its own recorded action.
+        """
+        if not recent_events:
+            return "No previous events."
+        
+        # Keep the newest events within the token budget, in chronological order
+        memo = self._events_memo
+        if memo and memo[0] is recent_events and memo[1] == len(recent_events):
+            chronological_events = memo[2]
         else:
-            template = """"""
+            chronological_events = self._trim_to_tokens(recent_events)
+            self._events_memo = (recent_events, len(recent_events), chronological_events)
         
-        prompt = template.format(
+        return "".join([
+            event_format(
+                round=event.get('round', 'unknown'),
+                desc=event.get('description', ''),
+                action=event.get('player_action', '') if player_action is None else player_action
+            )
+            for event in chronological_events
+        ])
+    
+    def _format_npcs(self, npc_relationships):
+        """Format NPC relationships for a prompt."""
+        if not npc_relationships:
+            return "No established NPC relationships yet."
+        
+        memo = self._npcs_memo
+        if memo and memo[0] is npc_relationships and memo[1] == len(npc_relationships):
+            return memo[2]
+        
+        npcs_text = "".join([
+            NPC_FORMAT(
+                name=npc.get('name', 'Unknown'),
+                relationship=npc.get('relationship', 'neutral'),
+                desc=npc.get('description', '')
+            )
+            for npc in npc_relationships
+        ])
+        self._npcs_memo = (npc_relationships, len(npc_relationships), npcs_text)
+        return npcs_text
+    
+    def _character_prompt(self, name, gender, background, traits, template=None):
+        """Build the character description prompt."""
+        template = template or ""
+        
+        # The template keeps the character fields at the end so the system prompt
+        # and instructions form an identical prefix on every call, which lets
+        # OpenAI's automatic prompt caching reuse it
+        return template.format(
             name=name,
             gender=gender,
             background=background,
             traits=traits
         )
-        #print(prompt)
-        
-        system_prompt = "You are a writer who is an expert and creating engaging stories"
-        
-        return self.generate_text(prompt, system_prompt)
+    
+    def generate_character_description(self, name, gender, background, traits, template=None):
+        """Generate a character description."""
+        prompt = self._character_prompt(name, gender, background, traits, template)
+        return self.generate_text(prompt, WRITER_SYSTEM_PROMPT)
+    
+    def stream_character_description(self, name, gender, background, traits, template=None):
+        """Generate a character description, yielding chunks as they arrive."""
+        prompt = self._character_prompt(name, gender, background, traits, template)
+        return self.stream_text(prompt, WRITER_SYSTEM_PROMPT)
+    
+    def _story_premise_prompt(self, character_info, template_path=None):
+        """Build the story premise prompt."""
+        template = _load_template(str(template_path)) if template_path else ""
+    
+        return template.format(
+            character_info=character_info
+        )
     
     def generate_story_premise(self, character_info, template_path=None):
         """Generate a story premise."""
-        template = ""
-        
-        if template_path and Path(template_path).exists():
-            with open(template_path, 'r') as f:
-                template = f.read()
-        else:
-            template = ""
+        prompt = self._story_premise_prompt(character_info, template_path)
+        return self.generate_text(prompt, WRITER_SYSTEM_PROMPT, temperature=0.7, max_tokens=2000)
     
+    def stream_story_premise(self, character_info, template_path=None):
+        """Generate a story premise, yielding chunks as they arrive."""
+        prompt = self._story_premise_prompt(character_info, template_path)
+        return self.stream_text(prompt, WRITER_SYSTEM_PROMPT, temperature=0.7, max_tokens=2000)
+
+
+    def stream_story_start(self, character_info, template_path):
+        """Generate the story premise and opening segment in one request,
+        yielding chunks as they arrive; see split_story_start."""
+        template = _load_template(str(template_path))
         prompt = template.format(
             character_info=character_info
         )
-
-        system_prompt = "You are a writer who is an expert and creating engaging stories"
-        
-        return self.generate_text(prompt, system_prompt, temperature=0.7, max_tokens=2000) 
-
+        return self.stream_text(
+            prompt, self._system_prompt, temperature=0.7, max_tokens=2000 + SEGMENT_MAX_TOKENS
+        )
 
     def summarize_story(self, story_premise, character_description, current_summary, 
                               recent_events, npc_relationships, player_action, 
-                              template_path=None):
-        """Summarize the story."""
+                              template_path=None, template_source=None, latest_event=None):
+        """Summarize the story.
+        
+        latest_event, the segment just shown, is formatted after recent_events
+        so the recent_events list formatted for the segment prompt is reused.
+        Returns a JSON object with the summary plus the NPCs met and items
+        found in the latest events; see parse_summary.
+        """
         template = ""
-        #print("+ Summarize the story. +")
         
-        if template_path and isinstance(template_path, str) and Path(template_path).exists():
-            #print("+ Template path exists. +")
-            with open(template_path, 'r') as f:
-                template = f.read()
-        else:
+        if template_source is not None:
+            template = template_source
+        elif template_path and isinstance(template_path, str):
+            template = _load_template(template_path)
+        
+        if not template:
             template = """
 Summarize the story so far, incorporating the recent events. Create a cohesive narrative that captures the key elements of the story.
 
@@ -137,40 +374,22 @@ NPC Relationships:
 Latest Player Action:
 {player_action}
 
-Create a comprehensive summary of the story so far:
+Create a comprehensive summary of the story so far. Also list the characters the player has met and the items the player has picked up or been given in the latest round.
+
+Respond with only a JSON object in this format:
+{{"summary": "The summary", "npcs": [{{"name": "Character name", "description": "One sentence about them"}}], "items": ["Item name"]}}
 """
 
-        # Format recent events - reverse the order to get chronological order (oldest first)
-        events_text = ""
-        if recent_events:
-            # Reverse the events list to get chronological order (oldest first)
-            chronological_events = sorted(recent_events, key=lambda x: x.get('round', 0))
-            for event in chronological_events:
-                # Make sure we're handling dictionary items properly
-                round_num = event.get('round', 'unknown')
-                description = event.get('description', '')
-                player_action = player_action
-                
-                # Use the first paragraph of the description if it's too long
-                # if description and '\n\n' in description:
-                #     description = description.split('\n\n')[0]
-                
-                events_text += f"\n**********\n **Round {round_num}:**\n {description} (Player Choice: {player_action})\n"
-        else:
-            events_text = "No previous events."
-        
-        # Format NPC relationships
-        npcs_text = ""
-        if npc_relationships:
-            for npc in npc_relationships:
-                # Make sure we're handling dictionary items properly
-                name = npc.get('name', 'Unknown')
-                relationship = npc.get('relationship', 'neutral')
-                description = npc.get('description', '')
-                
-                npcs_text += f"- {name}: {relationship} - {description}\n"
-        else:
-            npcs_text = "No established NPC relationships yet."
+        # Format recent events and NPC relationships
+        events_text = self._format_events(recent_events, SUMMARY_EVENT_FORMAT, player_action)
+        if latest_event:
+            latest_text = SUMMARY_EVENT_FORMAT(
+                round=latest_event.get('round', 'unknown'),
+                desc=latest_event.get('description', ''),
+                action=player_action
+            )
+            events_text = events_text + latest_text if recent_events else latest_text
+        npcs_text = self._format_npcs(npc_relationships)
         
         prompt = template.format(
             story_premise=story_premise,
@@ -184,69 +403,34 @@ Create a comprehensive summary of the story so far:
         
         system_prompt = "You are a writer who is an expert at summarizing complex narratives in a concise and engaging way."
         
-        return self.generate_text(prompt, system_prompt, temperature=0.7, max_tokens=1000)
+        return self.generate_text(
+            prompt, system_prompt, temperature=0.7, max_tokens=1000,
+            response_format={"type": "json_object"}
+        )
 
-    def generate_story_segment(self, story_premise, character_description, current_situation, 
+    def _story_segment_prompt(self, story_premise, character_description, current_situation, 
                               recent_events, npc_relationships, player_action, 
-                              template_path=None):
-        """Generate a story segment."""
+                              template_path=None, template_source=None):
+        """Build the story segment prompt and its system prompt.
+        
+        template_source is the template text itself, used instead of reading
+        template_path when given.
+        """
         template = ""
-        # print("+ Generate a story segment. +")
-        # print ("+ Story premise: " + story_premise[:30] if story_premise else "") # First 10 chars or empty string
-        # print ("+ Character info: " + character_description[:30] if character_description else "") # First 10 chars or empty string
-        # #print ("+ Current situation: " + current_situation[:10] if current_situation else "") # First 10 chars or empty string
-        
-        # Properly handle arrays of dictionaries
-        # if recent_events:
-        #     #print(f"+ Recent events: {len(recent_events)} events")
-        # else:
-        #     print("+ Recent events: None")
-            
-        # if npc_relationships:
-        #     print(f"+ NPC relationships: {len(npc_relationships)} NPCs")
-        # else:
-        #     print("+ NPC relationships: None")
-            
-        # print ("+ Player action: " + player_action[:40] if player_action else "") # First 10 chars or empty string
+        logger.debug(
+            "Generating story segment: %d recent events, %d NPCs, action %r",
+            len(recent_events or ()), len(npc_relationships or ()), player_action
+        )
         
         # Ensure template_path is a string
-        if template_path and isinstance(template_path, str) and Path(template_path).exists():
-            with open(template_path, 'r') as f:
-                template = f.read()
-        else:
-            template = ""
+        if template_source is not None:
+            template = template_source
+        elif template_path and isinstance(template_path, str):
+            template = _load_template(template_path)
 
-        # Format recent events
-        events_text = ""
-        if recent_events:
-            # Sort events by round number to get chronological order (oldest first)
-            chronological_events = sorted(recent_events, key=lambda x: x.get('round', 0))
-            for event in chronological_events:
-                # Make sure we're handling dictionary items properly
-                round_num = event.get('round', 'unknown')
-                description = event.get('description', '')
-                player_choice = event.get('player_action', '')
-                
-                # Use the first paragraph of the description if it's too long
-                # if description and '\n\n' in description:
-                #     description = description.split('\n\n')[0]
-                
-                events_text += f"\n**********\n **Round {round_num}:**\n {description} \n Player Choice: {player_choice}\n"
-        else:
-            events_text = "No previous events."
-        
-        # Format NPC relationships
-        npcs_text = ""
-        if npc_relationships:
-            for npc in npc_relationships:
-                # Make sure we're handling dictionary items properly
-                name = npc.get('name', 'Unknown')
-                relationship = npc.get('relationship', 'neutral')
-                description = npc.get('description', '')
-                
-                npcs_text += f"- {name}: {relationship} - {description}\n"
-        else:
-            npcs_text = "No established NPC relationships yet."
+        # Format recent events and NPC relationships
+        events_text = self._format_events(recent_events, SEGMENT_EVENT_FORMAT)
+        npcs_text = self._format_npcs(npc_relationships)
         
         prompt = template.format(
             character_info=character_description,
@@ -257,12 +441,28 @@ Create a comprehensive summary of the story so far:
             player_response=player_action
         )
         
-        # Read system prompt if available
-        system_prompt = ""
-        system_prompt_path = Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "prompts" / "system_prompt.txt"
-        
-        if system_prompt_path.exists():
-            with open(system_prompt_path, 'r') as f:
-                system_prompt = f.read()
-        
-        return self.generate_text(prompt, system_prompt, temperature=0.7, max_tokens=2000) 
\ No newline at end of file
+        return prompt, self._system_prompt
+    
+    def generate_story_segment(self, story_premise, character_description, current_situation, 
+                              recent_events, npc_relationships, player_action, 
+                              template_path=None, template_source=None):
+        """Generate a story segment."""
+        prompt, system_prompt = self._story_segment_prompt(
+            story_premise, character_description, current_situation,
+            recent_events, npc_relationships, player_action, template_path, template_source
+        )
+        return self.generate_text(
+            prompt, system_prompt, temperature=0.7, max_tokens=SEGMENT_MAX_TOKENS, model=self.segment_model
+        )
+    
+    def stream_story_segment(self, story_premise, character_description, current_situation, 
+                             recent_events, npc_relationships, player_action, 
+                             template_path=None, template_source=None):
+        """Generate a story segment, yielding chunks as they arrive."""
+        prompt, system_prompt = self._story_segment_prompt(
+            story_premise, character_description, current_situation,
+            recent_events, npc_relationships, player_action, template_path, template_source
+        )
+        return self.stream_text(
+            prompt, system_prompt, temperature=0.7, max_tokens=SEGMENT_MAX_TOKENS, model=self.segment_model
+        )
@@ -3,11 +3,19 @@
 Text Adventure Game - Main Entry Point
 A post-apocalyptic text adventure game powered by LLM.
 """
+import logging
 import os
 import sys
 import time
 from dotenv import load_dotenv
 
+# Load readline up front so the first prompt doesn't stall initializing it;
+# input() then gets line editing and history
+try:
+    import readline
+except ImportError:
+    readline = None
+
 from config import Config
 from character import CharacterManager
 from story_engine import StoryEngine
@@ -15,11 +23,21 @@ from memory import MemoryManager
 from input_handler import InputHandler
 from llm import LLMClient
 from db import Database
-from text_formatter import bold, colored, CYAN, YELLOW, format_story_text, format_markdown
+from text_formatter import bold, colored, CYAN, YELLOW, format_story_text, format_markdown, type_out
+
+# Clears the screen and moves the cursor home on VT-capable terminals
+CLEAR_SCREEN = "\x1b[2J\x1b[H"
 
 def clear_screen():
     """Clear the console screen."""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    # Legacy Windows consoles and redirected output don't understand ANSI
+    # escapes, so only shell out to cls/clear there
+    if not sys.stdout.isatty() or (os.name == 'nt' and not os.environ.get('WT_SESSION')):
+        os.system('cls' if os.name == 'nt' else 'clear')
+        return
+    
+    sys.stdout.write(CLEAR_SCREEN)
+    sys.stdout.flush()
 
 def print_slow(text, delay=0.03):
     """Print text with a typing effect."""
@@ -30,12 +48,23 @@ def print_slow(text, delay=0.03):
     # Apply text formatting
     formatted_text = format_markdown(text)
     
-    for char in formatted_text:
-        sys.stdout.write(char)
-        sys.stdout.flush()
-        time.sleep(delay)
+    type_out(formatted_text, delay)
     print()
 
+def read_user_line(prompt):
+    """Read one line of player input."""
+    # Interactive terminals go through readline for editing; piped input is
+    # read directly
+    if readline and sys.stdin.isatty():
+        return input(prompt).strip()
+    
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.strip()
+
 def display_title():
     """Display the game title."""
     clear_screen()
@@ -56,13 +85,20 @@ def main():
     # Load environment variables
     load_dotenv()
     
+    # Keep library and debug output off the game screen
+    logging.basicConfig(level=logging.WARNING)
+    
     # Initialize components
     config = Config()
     db = Database(config.db_path)
-    llm_client = LLMClient(api_key=os.getenv("OPENAI_API_KEY"))
+    llm_client = LLMClient(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=config.model,
+        segment_model=config.segment_model
+    )
     memory_manager = MemoryManager(db)
     character_manager = CharacterManager(db, llm_client)
-    story_engine = StoryEngine(db, llm_client, memory_manager)
+    story_engine = StoryEngine(db, llm_client, memory_manager, config.prefetch_choices)
     input_handler = InputHandler(story_engine, memory_manager)
     
     # Display title
@@ -78,7 +114,8 @@ def main():
     game_active = True
     while game_active:
         # Get player input
-        user_input = input("\n> ").strip()
+        # Prefetched segments keep generating in the background while this blocks
+        user_input = read_user_line("\n> ")
         
         # Process input
         result = input_handler.process_input(user_input, player)
@@ -93,6 +130,7 @@ def main():
     
     # End game
     story_engine.end_game(player)
+    db.close()
     print_slow("\nThank you for playing!")
 
 if __name__ == "__main__":
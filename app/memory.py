@@ -2,6 +2,54 @@
 Memory management module for the text adventure game.
 Handles game state and memory tracking.
 """
+import re
+
+# The text before the first quote on each line that contains dialogue
+DIALOGUE_PREFIX_RE = re.compile(r"^([^\"'\n]*)[\"'].*$", re.MULTILINE)
+
+# The word just before a speech verb, as in "Marcus said"
+SPEAKER_RE = re.compile(r"(\S+)\s+(?:says|said|asked|replied|shouted|whispered)\b")
+
+# Words that look like speakers but never name an NPC
+PRONOUNS = frozenset({'you', 'i', 'we', 'they'})
+
+# Phrases like "you found a [item]" or "you picked up [item]"
+ITEM_INDICATORS = (
+    "found a ", "found an ", "picked up a ", "picked up an ",
+    "discovered a ", "discovered an ", "obtained a ", "obtained an ",
+    "received a ", "received an ", "given a ", "given an "
+)
+
+# An item name runs up to the end of its sentence or clause
+ITEM_END_RE = re.compile(r"[.,\n]")
+
+# Find every item in one pass over the text, with pyahocorasick when it's
+# installed and a single regex otherwise. Each item runs from its indicator
+# to the next delimiter or indicator; both scanners yield its (start, end)
+# offsets so the caller can slice the original text
+try:
+    import ahocorasick
+    
+    _ITEM_AUTOMATON = ahocorasick.Automaton()
+    for _indicator in ITEM_INDICATORS:
+        _ITEM_AUTOMATON.add_word(_indicator, len(_indicator))
+    _ITEM_AUTOMATON.make_automaton()
+    
+    def _find_items(text):
+        """Yield the (start, end) span of each item name in lowercase text."""
+        spans = [(end - length + 1, end + 1) for end, length in _ITEM_AUTOMATON.iter(text)]
+        for i, (_, start) in enumerate(spans):
+            stop = spans[i + 1][0] if i + 1 < len(spans) else len(text)
+            end = ITEM_END_RE.search(text, start, stop)
+            yield start, end.start() if end else stop
+except ImportError:
+    _INDICATOR_PATTERN = "|".join(re.escape(indicator) for indicator in ITEM_INDICATORS)
+    _ITEM_RE = re.compile(rf"(?:{_INDICATOR_PATTERN})(.*?)(?=[.,\n]|{_INDICATOR_PATTERN}|\Z)")
+    
+    def _find_items(text):
+        """Yield the (start, end) span of each item name in lowercase text."""
+        for match in _ITEM_RE.finditer(text):
+            yield match.span(1)
 
 class MemoryManager:
     """Manages game state and memory."""
@@ -9,14 +57,34 @@ class MemoryManager:
     def __init__(self, db):
         """Initialize the memory manager."""
         self.db = db
+        # Lowercase names of the NPCs known in each game, filled on first use
+        self._npc_names = {}
+        # Write-through copy of each game's state, so reads right after a
+        # write don't go back to the database
+        self._state_cache = {}
     
     def get_game_state(self, game_id):
         """Get the current game state."""
-        return self.db.get_game_state(game_id)
+        state = self._state_cache.get(game_id)
+        if state is None:
+            state = self._state_cache[game_id] = self.db.get_game_state(game_id)
+        return dict(state)
     
     def update_game_state(self, game_id, current_round=None, current_situation=None, story_premise=None, current_summary=None):
         """Update the game state."""
         self.db.update_game_state(game_id, current_round, current_situation, story_premise, current_summary)
+        
+        # Mirror the update, leaving fields passed as None unchanged
+        state = self._state_cache.get(game_id)
+        if state is not None:
+            for field, value in (
+                ('current_round', current_round),
+                ('current_situation', current_situation),
+                ('story_premise', story_premise),
+                ('current_summary', current_summary)
+            ):
+                if value is not None:
+                    state[field] = value
     
     def add_event(self, game_id, round_num, description, player_action):
         """Add a new event to the game history."""
@@ -31,18 +99,59 @@ class MemoryManager:
         """Get recent events from the game history."""
         return self.db.get_recent_events(game_id, limit)
     
+    def load_turn_context(self, game_id, event_limit=10):
+        """Get the game state, recent events and NPCs needed to play a turn."""
+        cached_state = self._state_cache.get(game_id)
+        game_state, recent_events, npcs = self.db.fetch_turn_bundle(
+            game_id, event_limit, with_state=cached_state is None
+        )
+        if game_state is None:
+            game_state = dict(cached_state)
+        else:
+            self._state_cache[game_id] = dict(game_state)
+        
+        return {
+            "game_state": game_state,
+            "recent_events": recent_events,
+            "npcs": npcs
+        }
+    
     def add_npc(self, game_id, name, description, relationship="neutral", first_met_round=1):
         """Add a new NPC to the game."""
         self.db.add_npc(game_id, name, description, relationship, first_met_round)
+        if game_id in self._npc_names:
+            self._npc_names[game_id].add(name.lower())
+    
+    def add_npcs_bulk(self, game_id, npcs):
+        """Add several NPCs at once from (name, description, relationship, first_met_round) tuples."""
+        self.db.add_npcs(game_id, npcs)
+        if game_id in self._npc_names:
+            self._npc_names[game_id].update(npc[0].lower() for npc in npcs)
     
     def update_npc(self, npc_id, description=None, relationship=None):
         """Update an NPC's information."""
         self.db.update_npc(npc_id, description, relationship)
     
+    def update_npcs(self, updates):
+        """Update several NPCs at once from (description, relationship, npc_id) tuples."""
+        self.db.update_npcs(updates)
+    
     def get_npcs(self, game_id):
         """Get all NPCs for a game."""
         return self.db.get_npcs(game_id)
     
+    def iter_npcs(self, game_id):
+        """Yield the NPCs for a game one at a time."""
+        return self.db.iter_npcs(game_id)
+    
+    def _known_npc_names(self, game_id):
+        """Get the lowercase names of the NPCs already in a game."""
+        names = self._npc_names.get(game_id)
+        if names is None:
+            names = {npc['name'].lower() for npc in self.iter_npcs(game_id)}
+            self._npc_names[game_id] = names
+        return names
+    
     def update_inventory(self, game_id, items):
         """Update the player's inventory."""
         self.db.update_inventory(game_id, items)
@@ -56,39 +165,34 @@ class MemoryManager:
         # This is a simple implementation that could be enhanced with NLP
         # For now, we'll look for common NPC indicators in the text
         
-        lines = text.split('\n')
-        potential_npcs = []
-        
-        # Look for dialogue indicators or name patterns
-        for line in lines:
-            if '"' in line or "'" in line:
-                # Look for patterns like "Name: dialogue" or "Name said"
-                parts = line.split('"')[0].split("'")[0].strip()
-                if ':' in parts:
-                    name = parts.split(':')[0].strip()
-                    if name and len(name) < 20 and name.lower() not in ['you', 'i', 'we', 'they']:
-                        potential_npcs.append(name)
-                
-                for word in ['says', 'said', 'asked', 'replied', 'shouted', 'whispered']:
-                    if word in parts:
-                        name_parts = parts.split(word)[0].strip().split()
-                        if name_parts and name_parts[-1].lower() not in ['you', 'i', 'we', 'they']:
-                            potential_npcs.append(name_parts[-1])
-        
         # Get existing NPCs
-        existing_npcs = self.get_npcs(game_id)
-        existing_names = [npc['name'].lower() for npc in existing_npcs]
-        
-        # Add new NPCs
-        for npc_name in potential_npcs:
-            if npc_name.lower() not in existing_names:
-                self.add_npc(
-                    game_id,
-                    npc_name,
-                    f"Met during round {current_round}",
-                    "neutral",
-                    current_round
-                )
+        existing_names = self._known_npc_names(game_id)
+        
+        # New NPC names keyed by lowercase name, in order of appearance
+        potential_npcs = {}
+        
+        # Look for patterns like "Name: dialogue" or "Name said" before the
+        # dialogue on each line
+        for match in DIALOGUE_PREFIX_RE.finditer(text):
+            prefix = match.group(1).strip()
+            names = [speaker.group(1) for speaker in SPEAKER_RE.finditer(prefix)]
+            if ':' in prefix:
+                name = prefix.split(':', 1)[0].strip()
+                if name and len(name) < 20:
+                    names.insert(0, name)
+            
+            for name in names:
+                lower_name = name.lower()
+                if lower_name not in PRONOUNS and lower_name not in existing_names:
+                    potential_npcs.setdefault(lower_name, name)
+        
+        # Add new NPCs in a single insert
+        new_npcs = [
+            (npc_name, f"Met during round {current_round}", "neutral", current_round)
+            for npc_name in potential_npcs.values()
+        ]
+        if new_npcs:
+            self.add_npcs_bulk(game_id, new_npcs)
     
     def extract_items_from_text(self, text, game_id):
         """Extract potential items from story text and add them to inventory."""
@@ -98,25 +202,22 @@ class MemoryManager:
         # Get current inventory
         current_inventory = self.get_inventory(game_id)
         
-        # Look for phrases like "you found a [item]" or "you picked up [item]"
-        item_indicators = [
-            "found a ", "found an ", "picked up a ", "picked up an ",
-            "discovered a ", "discovered an ", "obtained a ", "obtained an ",
-            "received a ", "received an ", "given a ", "given an "
-        ]
-        
         new_items = []
         lower_text = text.lower()
         
-        for indicator in item_indicators:
-            if indicator in lower_text:
-                parts = lower_text.split(indicator)
-                for i in range(1, len(parts)):
-                    item_part = parts[i].split(".")[0].split(",")[0].split("\n")[0]
-                    if item_part and len(item_part) < 30:
-                        item = item_part.strip()
-                        if item and item not in current_inventory and item not in new_items:
-                            new_items.append(item)
+        # Match case-insensitively but keep the item names as written. A few
+        # characters change length when lowercased, in which case the
+        # offsets no longer line up and the lowercase text is used instead
+        source_text = text if len(text) == len(lower_text) else lower_text
+        known_items = {item.lower() for item in current_inventory}
+        
+        for start, end in _find_items(lower_text):
+            item_part = source_text[start:end]
+            if item_part and len(item_part) < 30:
+                item = item_part.strip()
+                if item and item.lower() not in known_items:
+                    known_items.add(item.lower())
+                    new_items.append(item)
         
         # Update inventory if new items were found
         if new_items:
@@ -127,19 +228,44 @@ class MemoryManager:
         
         return []
     
+    def add_discoveries(self, game_id, current_round, npcs, items):
+        """Add NPCs and items reported by the story summary.
+        
+        npcs is a list of (name, description) tuples. Returns the items that
+        were new to the inventory.
+        """
+        existing_names = self._known_npc_names(game_id)
+        new_npcs = {}
+        for name, description in npcs:
+            lower_name = name.lower()
+            if lower_name not in PRONOUNS and lower_name not in existing_names:
+                new_npcs.setdefault(lower_name, (name, description or f"Met during round {current_round}", "neutral", current_round))
+        if new_npcs:
+            self.add_npcs_bulk(game_id, list(new_npcs.values()))
+        
+        current_inventory = self.get_inventory(game_id)
+        known_items = {item.lower() for item in current_inventory}
+        new_items = []
+        for item in items:
+            if item.lower() not in known_items:
+                known_items.add(item.lower())
+                new_items.append(item)
+        if new_items:
+            self.update_inventory(game_id, current_inventory + new_items)
+        
+        return new_items
+    
     def format_recent_events(self, game_id, limit=10):
         """Format recent events for display."""
         events = self.get_recent_events(game_id, limit)
         if not events:
             return "No events recorded yet."
         
-        formatted = "\n=== RECENT EVENTS ===\n"
-        for event in reversed(events):  # Show most recent last
-            formatted += f"\nRound {event['round']}:\n"
-            formatted += f"{event['description']}\n"
-            formatted += f"Your action: {event['player_action']}\n"
-        
-        return formatted
+        # Show most recent last
+        return "\n=== RECENT EVENTS ===\n" + "".join([
+            f"\nRound {event['round']}:\n{event['description']}\nYour action: {event['player_action']}\n"
+            for event in reversed(events)
+        ])
     
     def format_inventory(self, game_id):
         """Format inventory for display."""
@@ -148,11 +274,9 @@ class MemoryManager:
         if not items:
             return "Your inventory is empty."
         
-        formatted = "\n=== INVENTORY ===\n"
-        for i, item in enumerate(items, 1):
-            formatted += f"{i}. {item}\n"
-        
-        return formatted
+        return "\n=== INVENTORY ===\n" + "".join([
+            f"{i}. {item}\n" for i, item in enumerate(items, 1)
+        ])
     
     def format_npcs(self, game_id):
         """Format NPCs for display."""
@@ -161,9 +285,7 @@ class MemoryManager:
         if not npcs:
             return "You haven't met any notable characters yet."
         
-        formatted = "\n=== CHARACTERS YOU'VE MET ===\n"
-        for npc in npcs:
-            formatted += f"\n{npc['name']} ({npc['relationship']})\n"
-            formatted += f"{npc['description']}\n"
-        
-        return formatted 
\ No newline at end of file
+        return "\n=== CHARACTERS YOU'VE MET ===\n" + "".join([
+            f"\n{npc['name']} ({npc['relationship']})\n{npc['description']}\n"
+            for npc in npcs
+        ]) 
\ No newline at end of file
@@ -7,13 +7,78 @@ import sys
 import time
 from pathlib import Path
 import gc
+from concurrent.futures import ThreadPoolExecutor
 
-from text_formatter import format_story_text, bold, colored, underline, CYAN, GREEN, YELLOW, RED
+from llm import parse_summary, split_story_start
+from text_formatter import format_choices, format_markdown, format_story_text, bold, colored, underline, CYAN, GREEN, YELLOW, RED
+
+# Choices offered at the end of every story segment
+PREFETCH_CHOICES = ("1", "2", "3")
+
+# Characters that open inline markup, and that can start a markdown line
+INLINE_MARKUP = ("*", "_", "`")
+LINE_MARKERS = "#->*_`"
+
+# Help text shown for the H command, styled once at import
+HELP_TEXT = f"""
+{bold(colored('=== GAME HELP ===', CYAN))}
+
+{bold(colored('COMMANDS:', YELLOW))}
+- {bold('I')} or {bold('inventory')}: Check your inventory
+- {bold('J')} or {bold('journal')}: View your recent events
+- {bold('C')} or {bold('characters')}: See characters you've met
+- {bold('H')} or {bold('help')}: Display this help text
+- {bold('Q')} or {bold('quit')}: End the game
+
+{bold(colored('GAMEPLAY:', YELLOW))}
+- Type your actions or choices to progress the story
+- Be creative with your responses
+- Your choices affect the story and relationships
+
+{colored('The world is yours to explore. Good luck!', GREEN)}
+"""
+
+def _flushable_length(pending):
+    """Return how much of a partial line can be printed before the rest arrives.
+    
+    Only whole words of a plain prose line with no unclosed markup are
+    printed, and never up to a word that could be read as a line marker, so
+    formatting the rest of the line on its own gives the same result.
+    """
+    body = pending.lstrip()
+    if not body or body[0] in LINE_MARKERS or body[0].isdigit():
+        return 0
+    
+    cut = pending.rfind(' ')
+    while cut > 0 and not pending[cut + 1:cut + 2].isalpha():
+        cut = pending.rfind(' ', 0, cut)
+    if cut <= 0:
+        return 0
+    
+    # Bold markers pair up on their own, then single markers must too
+    prefix = pending[:cut + 1]
+    if prefix.count('**') % 2:
+        return 0
+    prefix = prefix.replace('**', '')
+    if any(prefix.count(mark) % 2 for mark in INLINE_MARKUP):
+        return 0
+    return cut + 1
+
+def _format_streamed(text, in_choices):
+    """Format part of a streamed segment.
+    
+    Returns the formatted text and whether the choices section has started;
+    text after the choices label is formatted as choices, as it would be if
+    the whole segment were formatted at once.
+    """
+    if in_choices:
+        return format_choices(format_markdown(text)), True
+    return format_story_text(text), "Choices:" in text or "CHOICES:" in text
 
 class StoryEngine:
     """Manages story generation and progression."""
     
-    def __init__(self, db, llm_client, memory_manager):
+    def __init__(self, db, llm_client, memory_manager, prefetch_choices=False):
         """Initialize the story engine."""
         self.db = db
         self.llm_client = llm_client
@@ -21,26 +86,107 @@ class StoryEngine:
         self.current_round = 1
         self.current_game_id = None
         self.current_player = None
-        self.story_log = []
+        # The story log is appended to a partial file as the game goes and
+        # renamed into place when the game ends
+        self._log_file = None
+        self._log_path = None
         self.input_handler = None  # Will be set by the input handler
+        
+        # Resolve the prompt templates once; None when a template is missing
+        prompts_dir = Path(__file__).resolve().parent.parent / "data" / "prompts"
+        self._start_tpl = self._template_or_none(prompts_dir / "story_start.txt")
+        self._premise_tpl = self._template_or_none(prompts_dir / "story_premise.txt")
+        self._story_tpl = self._template_or_none(prompts_dir / "story_generation.txt")
+        self._summary_tpl = self._template_or_none(prompts_dir / "summary.txt")
+        
+        # The per-turn templates are passed to the client as text so nothing
+        # is looked up or read while playing
+        self._story_source = Path(self._story_tpl).read_text() if self._story_tpl else None
+        self._summary_source = Path(self._summary_tpl).read_text() if self._summary_tpl else None
+        
+        # Speculatively generate the next segment for each choice while the
+        # player is reading
+        self.prefetch_choices = prefetch_choices
+        self._executor = ThreadPoolExecutor(max_workers=len(PREFETCH_CHOICES)) if prefetch_choices else None
+        self._prefetched = {}
+        
+        # Summarizes each segment while the player reads it; the result is
+        # collected at the start of the next turn
+        self._background = ThreadPoolExecutor(max_workers=2)
+        self._pending_summary = None
+    
+    @staticmethod
+    def _template_or_none(path):
+        """Return the template path as a string if it exists, else None."""
+        return str(path) if path.exists() else None
     
     def set_input_handler(self, input_handler):
         """Set the input handler reference."""
         self.input_handler = input_handler
     
-    def print_slow(self, text, delay=0.00):
-        """Print text with a typing effect."""
-        # Make sure text is a string
-        if not isinstance(text, str):
-            text = str(text)
+    def print_stream(self, chunks):
+        """Print streamed text as it arrives and return the full text."""
+        parts = []
+        pending = ""
+        in_choices = False
+        for chunk in chunks:
+            parts.append(chunk)
+            pending += chunk
+            # Format completed lines so markup split across chunks still renders
+            if "\n" in pending:
+                lines, pending = pending.rsplit("\n", 1)
+                formatted, in_choices = _format_streamed(lines, in_choices)
+                sys.stdout.write(formatted + "\n")
+                sys.stdout.flush()
             
-        # Apply text formatting before printing
-        formatted_text = format_story_text(text)
-        for char in formatted_text:
-            sys.stdout.write(char)
-            sys.stdout.flush()
-            time.sleep(delay)
+            # Paragraphs are single long lines, so print their whole words as
+            # they arrive rather than waiting for the line to end
+            flushable = _flushable_length(pending)
+            if flushable:
+                formatted, in_choices = _format_streamed(pending[:flushable], in_choices)
+                sys.stdout.write(formatted)
+                sys.stdout.flush()
+                pending = pending[flushable:]
+        if pending:
+            formatted, in_choices = _format_streamed(pending, in_choices)
+            sys.stdout.write(formatted)
         print()
+        return "".join(parts)
+    
+    def _prefetch_segments(self, story_premise, current_situation):
+        """Start generating the next segment for every choice in the background."""
+        if not self._executor:
+            return
+        
+        context = self.memory_manager.load_turn_context(self.current_game_id)
+        recent_events = context['recent_events']
+        npcs = context['npcs']
+        
+        for choice in PREFETCH_CHOICES:
+            # The latest event will carry the chosen action once it is picked
+            events = [
+                dict(event, player_action=choice) if event.get('round') == self.current_round else event
+                for event in recent_events
+            ]
+            self._prefetched[choice] = self._executor.submit(
+                self.llm_client.generate_story_segment,
+                story_premise,
+                self.current_player.get('description', ''),
+                current_situation,
+                events,
+                npcs,
+                choice,
+                self._story_tpl,
+                self._story_source
+            )
+    
+    def _take_prefetched(self, action):
+        """Return the prefetched segment future for an action and cancel the rest."""
+        future = self._prefetched.pop(action.strip(), None)
+        for other in self._prefetched.values():
+            other.cancel()
+        self._prefetched.clear()
+        return future
     
     def start_game(self, player):
         """Start a new game with the given player."""
@@ -48,54 +194,44 @@ class StoryEngine:
         self.current_game_id = player.get('game_id')
         self.current_round = 1
         
-        premise_template_path = Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "prompts" / "story_premise.txt"
-        story_template_path = Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "prompts" / "story_generation.txt"
-        
-        
-        # Generate the opening scenario
-        opening = self.llm_client.generate_story_premise(
-            player.get('description', ''),
-            premise_template_path if premise_template_path.exists() else None
-        )
-        
-        # Display the opening
-        self.print_slow(opening)
+        if self._start_tpl:
+            # Generate the premise and the opening segment in one request,
+            # displaying them as they stream in
+            opening, start = split_story_start(self.print_stream(self.llm_client.stream_story_start(
+                player.get('description', ''),
+                self._start_tpl
+            )))
+        else:
+            # Generate the opening scenario, displaying it as it streams in
+            opening = self.print_stream(self.llm_client.stream_story_premise(
+                player.get('description', ''),
+                self._premise_tpl
+            ))
+            
+            print('\n** Generating story segment **\n')
+            start = self.print_stream(self.llm_client.stream_story_segment(
+                opening,                                    # story_premise
+                player.get('description', ''),              # character_description
+                opening,                                    # current_situation
+                [],                                         # recent_events
+                [],                                         # npc_relationships
+                "begin the adventure",                      # player_action
+                self._story_tpl,
+                self._story_source
+            ))
         
         # Add to story log
-        self.story_log.append({
-            "round": self.current_round,
-            "text": opening,
-            "action": "begin the adventure"
-        })
+        self._open_story_log(player)
+        self._log_entry(self.current_round, opening, "begin the adventure")
         
-        # Update game state with story premise
+        # Update game state with the story premise and opening segment
         self.memory_manager.update_game_state(
             self.current_game_id,
             self.current_round,
-            opening,  # current_situation
+            start,    # current_situation
             opening,  # story_premise
             opening   # initial summary
         )
-        
-        print('\n** Generating story segment **\n')
-        start = self.llm_client.generate_story_segment(
-            opening,                                    # story_premise
-            player.get('description', ''),              # character_description
-            opening,                                    # current_situation
-            [],                                         # recent_events
-            [],                                         # npc_relationships
-            "begin the adventure",                      # player_action
-            str(story_template_path) if story_template_path.exists() else None
-        )
-
-        self.print_slow(start)
-
-        # Update game state
-        self.memory_manager.update_game_state(
-            self.current_game_id,
-            self.current_round,
-            start
-        )
     
         self.memory_manager.add_event(
             self.current_game_id,
@@ -108,6 +244,7 @@ class StoryEngine:
         self.memory_manager.extract_npcs_from_text(opening, self.current_game_id, self.current_round)
         new_items = self.memory_manager.extract_items_from_text(opening, self.current_game_id)
         
+        self._prefetch_segments(opening, start)
 
         # Notify about new items if any
         if new_items:
@@ -120,6 +257,11 @@ class StoryEngine:
         
         #print("\n\n$$$$ Action: " + action)
 
+        prefetched = self._take_prefetched(action)
+        
+        # Record the summary of the segment the player just read
+        self.collect_summary()
+
         # Update the previous event with the player's action
         self.memory_manager.update_previous_event_action(
             self.current_game_id,
@@ -130,59 +272,42 @@ class StoryEngine:
         # Increment round
         self.current_round += 1
         
-        # Get game state
-        game_state = self.memory_manager.get_game_state(self.current_game_id)
+        # Get game state, recent events and NPCs
+        context = self.memory_manager.load_turn_context(self.current_game_id)
+        game_state = context['game_state']
         current_situation = game_state.get('current_situation', '')
         story_premise = game_state.get('story_premise', '')
         current_summary = game_state.get('current_summary', '')
-        
-        # Get recent events
-        recent_events = self.memory_manager.get_recent_events(self.current_game_id)
-        
-        # Get NPCs
-        npcs = self.memory_manager.get_npcs(self.current_game_id)
-        
-        # Get template path
-        template_path = Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "prompts" / "story_generation.txt"
-        summary_template_path = Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "prompts" / "summary.txt"
-
-        # Generate the next story segment
-        next_segment = self.llm_client.generate_story_segment(
-            story_premise,                              # story_premise
-            self.current_player.get('description', ''), # character_description
-            current_situation,                          # current_situation
-            recent_events,                              # recent_events
-            npcs,                                       # npc_relationships
-            action,                                     # player_action
-            str(template_path) if template_path.exists() else None
-        )
+        recent_events = context['recent_events']
+        npcs = context['npcs']
+        
+        # Use the segment generated in the background for this choice if there
+        # is one, otherwise generate it now, displaying it as it streams in
+        if prefetched is not None and not prefetched.cancelled():
+            next_segment = self.print_stream([prefetched.result()])
+        else:
+            next_segment = self.print_stream(self.llm_client.stream_story_segment(
+                story_premise,                              # story_premise
+                self.current_player.get('description', ''), # character_description
+                current_situation,                          # current_situation
+                recent_events,                              # recent_events
+                npcs,                                       # npc_relationships
+                action,                                     # player_action
+                self._story_tpl,
+                self._story_source
+            ))
         
         # print("\n\n$$$$ Next segment:\n")
         # print(next_segment)
         # print("\n$$$$\n")
 
-        # Summarize the story
-        summary = self.llm_client.summarize_story(
-            story_premise,
-            self.current_player.get('description', ''),
-            current_summary,
-            recent_events,
-            npcs,
-            action,
-            str(summary_template_path) if summary_template_path.exists() else None
-        )
-
-        # print("\n\n$$$$ Summary:\n")
-        # print(summary)
-        # print("\n$$$$\n")
-
-        # Update game state with new situation and summary
+        # Update game state with the new situation; the summary follows once
+        # it has been generated
         self.memory_manager.update_game_state(
             self.current_game_id,
             self.current_round,
             next_segment,
-            story_premise,  # Preserve the story premise
-            summary         # Update the summary
+            story_premise  # Preserve the story premise
         )
         
         # Add the new segment as an event (without player action yet)
@@ -193,23 +318,27 @@ class StoryEngine:
             ""  # No player action for this event yet
         )
         
-        # Extract potential NPCs and items
-        self.memory_manager.extract_npcs_from_text(next_segment, self.current_game_id, self.current_round)
-        new_items = self.memory_manager.extract_items_from_text(next_segment, self.current_game_id)
+        # Add to story log
+        self._log_entry(self.current_round, next_segment, action)
         
-        # Display the story segment
-        self.print_slow(next_segment)
+        # Summarize the story including the new segment while the player
+        # reads it, so it reports the NPCs and items of the round just shown
+        summary_future = self._background.submit(
+            self.llm_client.summarize_story,
+            story_premise,
+            self.current_player.get('description', ''),
+            current_summary,
+            recent_events,
+            npcs,
+            action,
+            self._summary_tpl,
+            self._summary_source,
+            {'round': self.current_round, 'description': next_segment}
+        )
         
-        # Add to story log
-        self.story_log.append({
-            "round": self.current_round,
-            "text": next_segment,
-            "action": action
-        })
+        self._pending_summary = (summary_future, self.current_round, next_segment)
         
-        # Notify about new items if any
-        if new_items:
-            print("\nAdded to inventory: " + ", ".join(new_items))
+        self._prefetch_segments(story_premise, next_segment)
         
         # Reset the expecting_choice flag in the input handler to ensure
         # the next input will be validated as a choice
@@ -218,6 +347,35 @@ class StoryEngine:
         
         return next_segment
     
+    def collect_summary(self):
+        """Wait for the pending story summary and record it with its discoveries."""
+        if self._pending_summary is None:
+            return
+        
+        summary_future, round_num, segment = self._pending_summary
+        self._pending_summary = None
+        summary, npcs_met, items_found = parse_summary(summary_future.result())
+
+        # print("\n\n$$$$ Summary:\n")
+        # print(summary)
+        # print("\n$$$$\n")
+
+        self.memory_manager.update_game_state(self.current_game_id, current_summary=summary)
+        
+        # Record the NPCs and items from the summary, falling back to scanning
+        # the segment if the summary wasn't valid JSON
+        if npcs_met is None:
+            self.memory_manager.extract_npcs_from_text(segment, self.current_game_id, round_num)
+            new_items = self.memory_manager.extract_items_from_text(segment, self.current_game_id)
+        else:
+            new_items = self.memory_manager.add_discoveries(
+                self.current_game_id, round_num, npcs_met, items_found
+            )
+        
+        # Notify about new items if any
+        if new_items:
+            print("\nAdded to inventory: " + ", ".join(new_items))
+    
     def end_game(self, player):
         """End the current game and generate an epilogue."""
         if not self.current_game_id:
@@ -225,6 +383,17 @@ class StoryEngine:
         
         print("\n=== GAME OVER ===\n")
         
+        # Drop any segments still being prefetched; cancelling the futures
+        # ourselves keeps this working on Python 3.8
+        self._take_prefetched("")
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        # Record the last segment's summary before the executor goes away. A
+        # prefetch request already in flight can't be cancelled and still
+        # holds up interpreter exit until it returns
+        self.collect_summary()
+        self._background.shutdown(wait=False)
+        
         # Generate an epilogue
         recent_events = self.memory_manager.get_recent_events(self.current_game_id, 10)
         
@@ -232,61 +401,54 @@ class StoryEngine:
         
         system_prompt = ""
         
-        epilogue = self.llm_client.generate_text(epilogue_prompt, system_prompt)
-        
-        # Display the epilogue
+        # Display the epilogue as it streams in
         print("\n=== EPILOGUE ===\n")
-        self.print_slow(epilogue)
+        epilogue = self.print_stream(self.llm_client.stream_text(epilogue_prompt, system_prompt))
         
         # Save the complete story to a file
         self._save_story_log(player)
         
         return epilogue
     
-    def _save_story_log(self, player):
-        """Save the complete story to a file."""
-        if not self.story_log:
-            return
-        
+    def _open_story_log(self, player):
+        """Start the story log file for a new game."""
         # Create logs directory if it doesn't exist
-        logs_dir = Path(os.path.dirname(os.path.abspath(__file__))).parent / "data" / "logs"
+        logs_dir = Path(__file__).resolve().parent.parent / "data" / "logs"
         logs_dir.mkdir(exist_ok=True)
         
         # Create a filename based on player name and timestamp
-        filename = f"{player['name'].lower().replace(' ', '_')}_{int(time.time())}.txt"
-        file_path = logs_dir / filename
-        
-        with open(file_path, 'w') as f:
-            f.write(f"=== ADVENTURE LOG: {player['name']} ===\n\n")
-            f.write(f"Background: {player['background']}\n")
-            f.write(f"Traits: {player['traits']}\n\n")
-            f.write(f"{player['description']}\n\n")
-            f.write("=== THE JOURNEY ===\n\n")
-            
-            for entry in self.story_log:
-                f.write(f"--- Round {entry['round']} ---\n\n")
-                f.write(f"{entry['text']}\n\n")
-                f.write(f"Your action: {entry['action']}\n\n")
+        self._log_path = logs_dir / f"{player['name'].lower().replace(' ', '_')}_{int(time.time())}.txt"
+        
+        self._log_file = open(self._log_path.with_name("_partial_" + self._log_path.name), 'w', buffering=1 << 16)
+        self._log_file.writelines([
+            f"=== ADVENTURE LOG: {player['name']} ===\n\n",
+            f"Background: {player['background']}\n",
+            f"Traits: {player['traits']}\n\n",
+            f"{player['description']}\n\n",
+            "=== THE JOURNEY ===\n\n"
+        ])
+    
+    def _log_entry(self, round_num, text, action):
+        """Append one round to the story log."""
+        if self._log_file:
+            self._log_file.write(
+                f"--- Round {round_num} ---\n\n"
+                f"{text}\n\n"
+                f"Your action: {action}\n\n"
+            )
+    
+    def _save_story_log(self, player):
+        """Save the complete story to a file."""
+        if not self._log_file:
+            return
         
-        print(f"\nYour adventure has been saved to: {file_path}")
+        partial_path = self._log_file.name
+        self._log_file.close()
+        self._log_file = None
+        os.replace(partial_path, self._log_path)
+        
+        print(f"\nYour adventure has been saved to: {self._log_path}")
     
     def get_help_text(self):
         """Get help text for the game."""
-        help_text = f"""
-{bold(colored('=== GAME HELP ===', CYAN))}
-
-{bold(colored('COMMANDS:', YELLOW))}
-- {bold('I')} or {bold('inventory')}: Check your inventory
-- {bold('J')} or {bold('journal')}: View your recent events
-- {bold('C')} or {bold('characters')}: See characters you've met
-- {bold('H')} or {bold('help')}: Display this help text
-- {bold('Q')} or {bold('quit')}: End the game
-
-{bold(colored('GAMEPLAY:', YELLOW))}
-- Type your actions or choices to progress the story
-- Be creative with your responses
-- Your choices affect the story and relationships
-
-{colored('The world is yours to explore. Good luck!', GREEN)}
-"""
-        return help_text 
\ No newline at end of file
+        return HELP_TEXT
@@ -2,6 +2,10 @@
 Text formatting utilities for the text adventure game.
 Provides functions for styling terminal text with colors and formatting.
 """
+import re
+import sys
+import time
+from functools import lru_cache
 
 # ANSI escape codes for text styling
 RESET = "\033[0m"
@@ -31,33 +35,112 @@ BG_MAGENTA = "\033[45m"
 BG_CYAN = "\033[46m"
 BG_WHITE = "\033[47m"
 
+# Splits text into alternating plain text and ANSI escape sequences
+ANSI_ESCAPE_RE = re.compile(r'(\x1b\[[0-9;]*m)')
+
+# Anything that could start a markdown construct; text without it is left as is
+MARKDOWN_SENTINEL_RE = re.compile(r'[*_#>`\-]|^\s*\d+\.', re.MULTILINE)
+
+# A line that starts with a header, list, quote or rule marker
+LINE_MARKUP_RE = re.compile(r'^\s*[-#>*_\d]', re.MULTILINE)
+
+# Markdown patterns, compiled once
+BOLD_RE = re.compile(r'\*\*(.*?)\*\*')
+ITALIC_RE = re.compile(r'(?<!\*)\*([^\*]+)\*(?!\*)')
+UNDERLINE_RE = re.compile(r'(?<!_)_([^_]+)_(?!_)')
+
+# Replacement templates for the emphasis passes
+BOLD_TEMPLATE = rf"{BOLD}\1{RESET}"
+ITALIC_TEMPLATE = rf"{ITALIC}\1{RESET}"
+UNDERLINE_TEMPLATE = rf"{UNDERLINE}\1{RESET}"
+
+# Horizontal rule markers, and what a rule is replaced with
+HR_MARKERS = frozenset(("---", "***", "___"))
+HR_LINE = f"\n{CYAN}{'─' * 80}{RESET}\n"
+
+# The choices label, and a numbered choice such as "1." or "**1.**"
+CHOICES_LABEL_RE = re.compile(r'\*\*Choices:\*\*|Choices:')
+CHOICE_RE = re.compile(r'^(\s*)(?:\*\*)?(\d+)(?:\.\*\*|\.)(.*)$', re.MULTILINE)
+BOLD_CHOICES = f"{BOLD}Choices:{RESET}"
+CHOICE_TEMPLATE = rf"\1{YELLOW}\2.{RESET}\3"
+
+def type_out(formatted_text, delay):
+    """Write already formatted text with a typing effect.
+    
+    Escape sequences are written instantly; visible text is flushed a word
+    at a time against a running deadline instead of sleeping per character.
+    """
+    deadline = time.perf_counter()
+    for i, segment in enumerate(ANSI_ESCAPE_RE.split(formatted_text)):
+        if i % 2:
+            sys.stdout.write(segment)
+            continue
+        
+        for char in segment:
+            sys.stdout.write(char)
+            deadline += delay
+            if char == ' ' or char == '\n':
+                sys.stdout.flush()
+                remaining = deadline - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
+    
+    sys.stdout.flush()
+    remaining = deadline - time.perf_counter()
+    if remaining > 0:
+        time.sleep(remaining)
+
+# Labels and menu entries are styled with the same arguments over and over
+@lru_cache(maxsize=1024)
 def bold(text):
     """Format text as bold."""
     return f"{BOLD}{text}{RESET}"
 
+@lru_cache(maxsize=1024)
 def italic(text):
     """Format text as italic."""
     return f"{ITALIC}{text}{RESET}"
 
+@lru_cache(maxsize=1024)
 def underline(text):
     """Format text as underlined."""
     return f"{UNDERLINE}{text}{RESET}"
 
+@lru_cache(maxsize=1024)
 def colored(text, color):
     """Format text with specified color."""
     return f"{color}{text}{RESET}"
 
+@lru_cache(maxsize=1024)
 def bg_colored(text, bg_color):
     """Format text with specified background color."""
     return f"{bg_color}{text}{RESET}"
 
 def styled(text, *styles):
     """Apply multiple styles to text."""
-    styled_text = text
-    for style in styles:
-        styled_text = f"{style}{styled_text}"
-    return f"{styled_text}{RESET}"
+    # Later styles wrap earlier ones, so they come first
+    return f"{''.join(reversed(styles))}{text}{RESET}"
+
+# h1 and h2 get special treatment
+HEADER_PREFIXES = {1: BOLD + CYAN, 2: BOLD + YELLOW}
+
+def _marker_content(body, start):
+    """Return the text after a header, list or quote marker, or None if there is none."""
+    if not body[start:start + 1].isspace():
+        return None
+    return body[start:].lstrip() or None
 
+def _header_lines(line):
+    """Return the output lines for a line that may be a markdown header."""
+    level = len(line) - len(line.lstrip('#'))
+    content = level <= 6 and _marker_content(line, level)
+    if not content:
+        return (line,)
+    if level <= 2:
+        return ("", HEADER_PREFIXES[level] + content + RESET, "")
+    return ("", BOLD + content + RESET)
+
+@lru_cache(maxsize=256)
 def format_markdown(text):
     """Format markdown text with appropriate terminal styling.
     
@@ -72,92 +155,100 @@ def format_markdown(text):
     - Code blocks (```code```)
     - Horizontal rules (---, ___, ***)
     """
-    import re
-    
-    # Process headers (# Header)
-    for i in range(6, 0, -1):  # Process h6 to h1
-        pattern = r'^' + r'#' * i + r'\s+(.+?)$'
-        if i <= 2:  # h1 and h2 get special treatment
-            color = CYAN if i == 1 else YELLOW
-            text = re.sub(pattern, 
-                         lambda m: f"\n{BOLD}{color}{m.group(1)}{RESET}\n", 
-                         text, 
-                         flags=re.MULTILINE)
-        else:
-            text = re.sub(pattern, 
-                         lambda m: f"\n{BOLD}{m.group(1)}{RESET}", 
-                         text, 
-                         flags=re.MULTILINE)
+    # Nothing shorter than three characters can hold markup
+    if len(text) < 3:
+        return text
+    
+    # Most lines carry no markdown at all
+    if not MARKDOWN_SENTINEL_RE.search(text):
+        return text
     
     # Process bold (**text**)
-    text = re.sub(r'\*\*(.*?)\*\*', lambda m: f"{BOLD}{m.group(1)}{RESET}", text)
+    if '**' in text:
+        text = BOLD_RE.sub(BOLD_TEMPLATE, text)
     
     # Process italic (*text*)
-    text = re.sub(r'(?<!\*)\*([^\*]+)\*(?!\*)', lambda m: f"{ITALIC}{m.group(1)}{RESET}", text)
+    if '*' in text:
+        text = ITALIC_RE.sub(ITALIC_TEMPLATE, text)
     
     # Process underline (_text_)
-    text = re.sub(r'(?<!_)_([^_]+)_(?!_)', lambda m: f"{UNDERLINE}{m.group(1)}{RESET}", text)
-    
-    # Process bullet points
-    text = re.sub(r'^(\s*)-\s+(.+?)$',
-                 lambda m: f"{m.group(1)}• {m.group(2)}",
-                 text,
-                 flags=re.MULTILINE)
-    
-    # Process numbered lists with color
-    text = re.sub(r'^(\s*)(\d+)\.\s+(.+?)$',
-                 lambda m: f"{m.group(1)}{YELLOW}{m.group(2)}.{RESET} {m.group(3)}",
-                 text,
-                 flags=re.MULTILINE)
-    
-    # Process blockquotes
-    text = re.sub(r'^(\s*)>\s+(.+?)$',
-                 lambda m: f"{m.group(1)}{CYAN}│ {m.group(2)}{RESET}",
-                 text,
-                 flags=re.MULTILINE)
-    
-    # Process horizontal rules
-    text = re.sub(r'^(\s*)(---|\*\*\*|___)(\s*)$',
-                 lambda m: f"\n{CYAN}{'─' * 80}{RESET}\n",
-                 text,
-                 flags=re.MULTILINE)
+    if '_' in text:
+        text = UNDERLINE_RE.sub(UNDERLINE_TEMPLATE, text)
     
-    return text
-
-def format_choices(choices_text):
-    """Format the choices section of the story output.
+    # Only prose is left when no line starts with a marker
+    if not LINE_MARKUP_RE.search(text):
+        return text
     
-    Converts markdown-style formatting to terminal formatting.
-    Example: "**Choices:**" becomes bold text.
-    """
-    lines = choices_text.split('\n')
-    formatted_lines = []
+    # Process headers, bullet points, numbered lists, blockquotes and
+    # horizontal rules in a single pass over the lines
+    lines = text.split('\n')
+    if '#' in text:
+        lines = [
+            header_line
+            for line in lines
+            for header_line in (_header_lines(line) if line[:1] == '#' else (line,))
+        ]
     
+    formatted_lines = []
+    after_rule = False
+    skipped_blank = False
     for line in lines:
-        # Format "**Choices:**" or "Choices:" as bold
-        if "**Choices:**" in line:
-            line = line.replace("**Choices:**", f"{BOLD}Choices:{RESET}")
-        elif "Choices:" in line:
-            line = line.replace("Choices:", f"{BOLD}Choices:{RESET}")
+        body = line.lstrip()
         
-        # Format numbered choices with color and handle potential bold formatting in choices
-        # Check for various formats: "1.", "**1.**", etc.
-        import re
-        choice_pattern = re.compile(r'^(\s*)(\*\*)?(\d+)(\.\*\*|\.)(.*)$')
-        match = choice_pattern.match(line)
+        # A rule absorbs the blank lines around it
+        if not body and after_rule:
+            skipped_blank = True
+            continue
+        if body.rstrip() in HR_MARKERS:
+            while formatted_lines and not formatted_lines[-1].strip():
+                formatted_lines.pop()
+            if after_rule and skipped_blank:
+                formatted_lines[-1] += HR_LINE
+            else:
+                formatted_lines.append(HR_LINE)
+            after_rule = True
+            skipped_blank = False
+            continue
+        after_rule = False
         
-        if match:
-            spaces = match.group(1)
-            number = match.group(3)
-            rest = match.group(5)
-            
-            # Apply yellow color to the number
-            line = f"{spaces}{YELLOW}{number}.{RESET}{rest}"
+        indent = line[:len(line) - len(body)]
+        marker = body[:1]
+        if marker == '-':
+            content = _marker_content(body, 1)
+            if content:
+                line = f"{indent}• {content}"
+        elif marker == '>':
+            content = _marker_content(body, 1)
+            if content:
+                line = f"{indent}{CYAN}│ {content}{RESET}"
+        elif marker.isdecimal():
+            end = 1
+            while body[end:end + 1].isdecimal():
+                end += 1
+            content = body[end:end + 1] == '.' and _marker_content(body, end + 1)
+            if content:
+                line = f"{indent}{YELLOW}{body[:end]}.{RESET} {content}"
         
         formatted_lines.append(line)
     
     return '\n'.join(formatted_lines)
 
+def format_choices(choices_text):
+    """Format the choices section of the story output.
+    
+    Converts markdown-style formatting to terminal formatting.
+    Example: "**Choices:**" becomes bold text.
+    """
+    if not choices_text:
+        return choices_text
+    
+    # Format "**Choices:**" or "Choices:" as bold
+    choices_text = CHOICES_LABEL_RE.sub(BOLD_CHOICES, choices_text)
+    
+    # Apply yellow color to the number of each choice ("1.", "**1.**", etc.)
+    return CHOICE_RE.sub(CHOICE_TEMPLATE, choices_text)
+
+@lru_cache(maxsize=256)
 def format_story_text(text):
     """Format the entire story text with appropriate styling.
     
@@ -166,22 +257,13 @@ def format_story_text(text):
     # First, apply general markdown formatting
     text = format_markdown(text)
     
-    # Check for different ways the choices section might be formatted
-    choices_patterns = ["Choices:", "CHOICES:", "**Choices:**", "**CHOICES:**"]
-    
-    for pattern in choices_patterns:
-        if pattern in text:
-            # Split the text to separate the story from choices
-            parts = text.split(pattern, 1)
-            
-            if len(parts) > 1:
-                story_text = parts[0]
-                choices_text = "Choices:" + parts[1]  # Normalize to "Choices:"
-                
-                # Format the choices section
-                formatted_choices = format_choices(choices_text)
-                
-                return story_text + formatted_choices
+    # Split the story from the choices section. "Choices:" takes priority, and
+    # the bold forms are covered by the plain labels they contain
+    for label in ("Choices:", "CHOICES:"):
+        story_text, found, rest = text.partition(label)
+        if found:
+            # Normalize to "Choices:" and format the choices section
+            return story_text + format_choices("Choices:" + rest)
     
     # If we reach here, either there's no choices section or it's already been processed
-    return text 
\ No newline at end of file
+    return text